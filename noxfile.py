@@ -43,3 +43,11 @@ def scalene(session: nox.Session):
 
     session.run("poetry", "install", "--with=dev", "--no-root")
     session.run("scalene", "-m", "pytest")
+
+
+@nox.session
+def memory_profile(session: nox.Session):
+    """Profiles the memory of make_batch and eval at several sizes."""
+
+    session.run("poetry", "install", "--with=dev", "--no-root")
+    session.run("python", "-m", "src.memprof")
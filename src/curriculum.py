@@ -0,0 +1,185 @@
+"""
+Curriculum training data.  A bank of ship perimeters is rasterized once and composited with fresh
+pixel intensities, noise lines and background noise on the fly, and a Keras callback ramps the noise
+towards the `make_data` defaults.  Only the ship geometry is reused, so at the default noise the
+batches follow the `make_data` distribution over the finite set of banked ships.
+"""
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+from tensorflow import keras
+
+from src.helpers import _add_noise
+from src.helpers import _get_l2w
+from src.helpers import _get_pos
+from src.helpers import _get_rng
+from src.helpers import _get_size
+from src.helpers import _get_t2l
+from src.helpers import _get_yaw
+from src.helpers import _integers
+from src.helpers import _make_spaceships
+from src.helpers import _perimeter_pixels
+from src.helpers import _random
+
+
+class ShipBank:
+    """Rasterized ship perimeters stored sparsely: the pixels of ship `i` are
+    `pixels[offsets[i]:offsets[i + 1]]`, flat indices into a transposed (H, W) image like
+    `make_data_batch`.  Intensities are drawn whenever a ship is drawn.
+
+    Args:
+        size (int, optional): Number of ships. Defaults to 10000.
+        image_size (int, optional): Size of generated image. Defaults to 200.
+        rng (np.random.Generator, optional): Random generator. Defaults to None (global `np.random` state).
+    """
+
+    def __init__(
+        self,
+        size: int = 10000,
+        image_size: int = 200,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        rng = _get_rng(rng)
+        plane = image_size * image_size
+
+        pts, self.labels = _make_spaceships(
+            _get_pos(image_size, size, rng=rng),
+            _get_yaw(size, rng=rng),
+            _get_size(size, rng=rng),
+            _get_l2w(size, rng=rng),
+            _get_t2l(size, rng=rng),
+        )
+        idx, rr, cc = _perimeter_pixels(pts)
+        valid = (rr >= 0) & (rr < image_size) & (cc >= 0) & (cc < image_size)
+        idx = idx[valid]
+        flat = cc[valid] * image_size + rr[valid]
+
+        # a pixel drawn twice gets a single uniform intensity, like the scatter of `make_data_batch`
+        keys = np.unique(idx * plane + flat)
+
+        self.image_size = image_size
+        self.pixels = (keys % plane).astype(np.int32)
+        self.offsets = np.searchsorted(keys // plane, np.arange(size + 1))
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def draw(
+        self,
+        imgs: np.ndarray,
+        indices: np.ndarray,
+        ships: np.ndarray,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        """Writes ships with fresh uniform intensities into images.
+
+        Args:
+            imgs (np.ndarray): (N, H, W) images, written in place.
+            indices (np.ndarray): Images that get a ship.
+            ships (np.ndarray): Bank index of the ship of every image in `indices`.
+            rng (np.random.Generator, optional): Random generator. Defaults to None (global `np.random` state).
+        """
+        starts = self.offsets[ships]
+        lengths = self.offsets[ships + 1] - starts
+
+        # gather the pixel runs of all ships at once
+        ends = np.cumsum(lengths)
+        src = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - ends + lengths, lengths)
+        flat = np.repeat(indices, lengths) * self.image_size**2 + self.pixels[src]
+        imgs.reshape(-1)[flat] = _random(_get_rng(rng), src.size, imgs.dtype)
+
+
+def make_curriculum_batch(
+    bank: ShipBank,
+    batch_size: int,
+    has_spaceship: Union[bool, None] = None,
+    noise_level: float = 0.8,
+    no_lines: int = 6,
+    rng: Optional[np.random.Generator] = None,
+    dtype: np.dtype = np.float64,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Composites banked ships with fresh intensities and noise.  A drop-in for `make_data_batch`.
+
+    Args:
+        bank (ShipBank): Noise-free ship renders.
+        batch_size (int): Number of images to generate.
+        has_spaceship (bool, optional): Whether a spaceship is included. Defaults to None (randomly sampled per image).
+        noise_level (float, optional): Level of the background noise. Defaults to 0.8.
+        no_lines (int, optional): No. of lines for line noise. Defaults to 6.
+        rng (np.random.Generator, optional): Random generator. Defaults to None (global `np.random` state).
+        dtype (np.dtype, optional): Image dtype. Defaults to np.float64.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (N, H, W) images and the (N, 5) labels.
+        Label rows are NaN for images without a spaceship.
+    """
+
+    rng = _get_rng(rng)
+
+    if has_spaceship is None:
+        has_spaceship = rng.choice([True, False], size=batch_size, p=(0.8, 0.2))
+
+    indices = np.flatnonzero(np.broadcast_to(has_spaceship, (batch_size,)))
+    ships = _integers(rng, 0, len(bank), size=indices.size)
+
+    imgs = np.zeros((batch_size, bank.image_size, bank.image_size), dtype=dtype)
+    labels = np.full((batch_size, 5), np.nan)
+    labels[indices] = bank.labels[ships]
+    bank.draw(imgs, indices, ships, rng)
+
+    _add_noise(imgs, noise_level, no_lines, rng)
+
+    return imgs, labels
+
+
+class NoiseCurriculum(keras.callbacks.Callback):
+    """Custom Keras callback that ramps the noise linearly from an easy start to the `make_data`
+    defaults over `ramp_epochs`, and keeps the defaults afterwards.
+
+    Batches already prefetched by Keras at the start of an epoch keep the previous noise.
+
+    Args:
+        bank (ShipBank): Noise-free ship renders.
+        ramp_epochs (int, optional): Epochs until the noise reaches the defaults. Defaults to 10.
+        start_noise (float, optional): Background noise level of the first epoch. Defaults to 0.2.
+        start_lines (int, optional): Noise lines of the first epoch. Defaults to 0.
+        noise_level (float, optional): Final background noise level. Defaults to 0.8.
+        no_lines (int, optional): Final number of noise lines. Defaults to 6.
+    """
+
+    def __init__(
+        self,
+        bank: ShipBank,
+        ramp_epochs: int = 10,
+        start_noise: float = 0.2,
+        start_lines: int = 0,
+        noise_level: float = 0.8,
+        no_lines: int = 6,
+    ):
+        super().__init__()
+        self.bank = bank
+        self.ramp_epochs = ramp_epochs
+        self.start = (start_noise, start_lines)
+        self.end = (noise_level, no_lines)
+        self.noise_level, self.no_lines = self.schedule(0)
+
+    def schedule(self, epoch: int) -> Tuple[float, int]:
+        """Background noise level and number of noise lines of an epoch."""
+        t = epoch / max(1, self.ramp_epochs)
+        if t >= 1:
+            return self.end
+
+        noise_level = self.start[0] + t * (self.end[0] - self.start[0])
+        no_lines = int(round(self.start[1] + t * (self.end[1] - self.start[1])))
+        return noise_level, no_lines
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.noise_level, self.no_lines = self.schedule(epoch)
+
+    def make_data_batch(self, batch_size: int, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        """`make_curriculum_batch` at the noise of the current epoch."""
+        return make_curriculum_batch(
+            self.bank, batch_size, noise_level=self.noise_level, no_lines=self.no_lines, **kwargs
+        )
@@ -0,0 +1,160 @@
+"""
+Knowledge distillation of the combined (hydra) model into a single compact student.  The student has
+the same four outputs as the combined model, so it runs through `post_processing` and `eval` as is.
+"""
+from typing import List
+from typing import Tuple
+
+import numpy as np
+from tensorflow import keras
+from tensorflow.keras.layers import Activation
+from tensorflow.keras.layers import Dense
+from tensorflow.keras.models import Model
+
+from src.helpers import make_data_batch
+from src.helpers import sample_rng
+from src.main import average_precision
+from src.main import predict
+from src.main import VARIABLES
+from src.model_cache import load_cached_model
+from src.prune import count_params
+from src.prune import measure_latency
+from src.train import gen_base_model
+from src.train import HEADS
+from src.train import make_batch
+from src.train import RECIPES
+
+
+def gen_student(teacher: Model, nfilters: int = 4, hidden: int = 32) -> Model:
+    """Compact multi-output student.  A narrower base model trunk with one small head per output of
+    the teacher, each ending in the activation of the teacher output.
+
+    Args:
+        teacher (Model): Combined model.
+        nfilters (int, optional): Width multiplier of the conv trunk, the base model uses 8. Defaults to 4.
+        hidden (int, optional): Units of the hidden layer of every head. Defaults to 32.
+
+    Returns:
+        Model: Student model.
+    """
+
+    trunk = gen_base_model(nfilters)
+    x = trunk.layers[-5].output  # flattened features, like the `gen_*` heads
+
+    outputs = []
+    for name, output in zip(HEADS, teacher.outputs):
+        activation = getattr(output._keras_history.layer, "activation", None) or "linear"
+        y = Dense(hidden)(x)
+        y = Activation("relu")(y)
+        y = Dense(output.shape[-1])(y)
+        outputs.append(Activation(activation, name=name)(y))
+
+    return Model(inputs=trunk.input, outputs=outputs)
+
+
+def make_distillation_batch(
+    teacher: Model, batch_size: int = 64, alpha: float = 0.5
+) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Streams fresh samples and blends the teacher outputs with the ground truth.
+
+    The MSE to `alpha * teacher + (1 - alpha) * label` equals, up to a constant, the weighted sum of
+    the MSE to the teacher and the MSE to the label.  Images without a spaceship have no position,
+    angle or area labels, so the teacher is the only target for those outputs.
+
+    Args:
+        teacher (Model): Combined model.
+        batch_size (int, optional): Batch shape. Defaults to 64.
+        alpha (float, optional): Weight of the teacher outputs. Defaults to 0.5.
+
+    Returns:
+        Tuple[np.ndarray, List[np.ndarray]]: The image array and one target array per output.
+    """
+
+    imgs, labels = make_batch(batch_size=batch_size, has_spaceship=None, variables=VARIABLES)
+    soft = teacher.predict_on_batch(imgs)
+
+    targets = []
+    for head, teacher_output in zip(HEADS, soft):
+        hard = labels[:, [VARIABLES.index(c) for c in RECIPES[head][2]]]
+        target = np.where(
+            np.isnan(hard), teacher_output, alpha * teacher_output + (1 - alpha) * hard
+        )
+        targets.append(target)
+
+    return imgs, targets
+
+
+def train_student(
+    teacher: Model,
+    nfilters: int = 4,
+    batch_size: int = 64,
+    steps_per_epoch: int = 250,
+    epochs: int = 50,
+    alpha: float = 0.5,
+    model_path: str = "save/student_model",
+) -> Model:
+    """Distills the teacher into a student.
+
+    Args:
+        teacher (Model): Combined model.
+        nfilters (int, optional): Width multiplier of the student. Defaults to 4.
+        batch_size (int, optional): Batch shape. Defaults to 64.
+        steps_per_epoch (int, optional): Number of training steps per epoch. Defaults to 250.
+        epochs (int, optional): Number of epochs to train. Defaults to 50.
+        alpha (float, optional): Weight of the teacher outputs. Defaults to 0.5.
+        model_path (str, optional): Path of the best student. Defaults to "save/student_model".
+
+    Returns:
+        Model: The trained student.
+    """
+
+    checkpoint = keras.callbacks.ModelCheckpoint(
+        filepath=model_path,
+        monitor="loss",
+        verbose=1,
+        save_best_only=True,
+        mode="min",
+    )
+
+    model = gen_student(teacher, nfilters)
+
+    adam = keras.optimizers.Adam(learning_rate=0.001, beta_1=0.9, beta_2=0.999)
+    model.compile(loss=keras.losses.MeanSquaredError(), optimizer=adam)
+    model.summary()
+    model.fit(
+        iter(lambda: make_distillation_batch(teacher, batch_size=batch_size, alpha=alpha), None),
+        callbacks=[checkpoint],
+        steps_per_epoch=steps_per_epoch,
+        epochs=epochs,
+    )
+
+    return model
+
+
+def main(widths: Tuple[int, ...] = (2, 4, 8), no_samples: int = 1000, seed: int = 0):
+    """Distills students of several widths and prints their latency/AP tradeoff against the teacher.
+
+    Args:
+        widths (Tuple[int, ...], optional): Student width multipliers. Defaults to (2, 4, 8).
+        no_samples (int, optional): Number of evaluation samples. Defaults to 1000.
+        seed (int, optional): Seed of the evaluation samples. Defaults to 0.
+    """
+
+    teacher = load_cached_model("save/best_combined_model")
+    imgs, labels = make_data_batch(no_samples, rng=sample_rng(seed), dtype=np.float32)
+
+    models = {"teacher": teacher}
+    for width in widths:
+        models[f"student-{width}"] = train_student(
+            teacher, nfilters=width, model_path=f"save/student_model_{width}"
+        )
+
+    print(f"{'model':<12} {'params':>10} {'latency (ms)':>14} {'AP@0.7':>8}")
+    for name, model in models.items():
+        ap = average_precision(predict(model, imgs), labels)
+        latency = measure_latency(model)
+        print(f"{name:<12} {count_params(model):>10} {latency * 1e3:>14.2f} {ap:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
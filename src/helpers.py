@@ -1,11 +1,14 @@
+import atexit
+import itertools
+import multiprocessing as mp
+from collections.abc import Callable
+from typing import Iterator
 from typing import Optional
 from typing import Tuple
 from typing import Union
 
 import numpy as np
 from shapely.geometry import Polygon
-from skimage.draw import line
-from skimage.draw import polygon_perimeter
 
 
 def _rotation(pts: np.ndarray, theta: float) -> np.ndarray:
@@ -49,24 +52,193 @@ def _make_spaceship(
     return pts, params
 
 
-def _get_pos(s: float) -> np.ndarray:
-    return np.random.randint(10, s - 10, size=2)
+def _make_spaceships(
+    pos: np.ndarray, yaw: np.ndarray, scale: np.ndarray, l2w: np.ndarray, t2l: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized `_make_spaceship` for a batch of ships.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (N, 4, 2) ship vertices and the (N, 5) labels.
+    """
+    dim_x = np.asarray(scale, dtype=float)
+    dim_y = dim_x * l2w
+
+    # spaceship
+    pts = np.zeros((dim_x.size, 4, 2))
+    pts[:, 0, 1] = dim_y
+    pts[:, 1, 0] = -dim_x / 2
+    pts[:, 2, 1] = dim_y * t2l
+    pts[:, 3, 0] = dim_x / 2
+    pts[:, :, 1] -= dim_y[:, None] / 2
+
+    # rotation + translation
+    cos = np.cos(yaw)[:, None]
+    sin = np.sin(yaw)[:, None]
+    x = pts[:, :, 0] * cos + pts[:, :, 1] * sin
+    y = pts[:, :, 1] * cos - pts[:, :, 0] * sin
+    pts = np.stack([x, y], axis=-1) + pos[:, None, :]
+
+    # label
+    params = np.column_stack([pos, yaw, dim_x, dim_y])
+
+    return pts, params
+
+
+def _line_pixels(
+    r0: np.ndarray, c0: np.ndarray, r1: np.ndarray, c1: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Rasterizes many line segments in one pass.
+
+    The pixels are identical, and in the same order, as calling `skimage.draw.line` once per segment
+    and concatenating the results.  Pixel `i` of a segment is `i` steps along the major axis and
+    `(2 * minor * i + major) // (2 * major)` steps along the minor axis, which is the closed form of
+    the Bresenham error term used by skimage.
+
+    Args:
+        r0 (np.ndarray): Start rows.
+        c0 (np.ndarray): Start columns.
+        r1 (np.ndarray): End rows.
+        c1 (np.ndarray): End columns.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Segment index, row and column of every pixel.
+    """
+    r0, c0, r1, c1 = (np.asarray(v, dtype=np.intp).ravel() for v in (r0, c0, r1, c1))
+
+    dr = r1 - r0
+    dc = c1 - c0
+    steep = np.abs(dr) > np.abs(dc)
+    major = np.maximum(np.abs(dr), np.abs(dc))
+    minor = np.minimum(np.abs(dr), np.abs(dc))
+    lengths = major + 1
+
+    # position of every pixel along its own segment
+    seg = np.repeat(np.arange(lengths.size), lengths)
+    starts = np.cumsum(lengths) - lengths
+    i = np.arange(seg.size) - starts[seg]
+
+    step = (2 * minor[seg] * i + major[seg]) // (2 * np.maximum(major[seg], 1))
+    rr = r0[seg] + np.where(dr > 0, 1, -1)[seg] * np.where(steep[seg], i, step)
+    cc = c0[seg] + np.where(dc > 0, 1, -1)[seg] * np.where(steep[seg], step, i)
+
+    return seg, rr, cc
+
+
+def _line_length(r0: int, c0: int, r1: int, c1: int) -> int:
+    """Number of pixels `_line_pixels` draws for a single segment."""
+    return max(abs(r1 - r0), abs(c1 - c0)) + 1
+
+
+def _perimeter_pixels(pts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Rasterizes the perimeters of a batch of polygons in one pass.
+
+    Matches `skimage.draw.polygon_perimeter` (without clipping) applied to each polygon.
+
+    Args:
+        pts (np.ndarray): (N, K, 2) polygon vertices.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Polygon index, row and column of every pixel.
+    """
+    pts = np.round(pts).astype(np.intp)
+    start = pts
+    end = np.roll(pts, -1, axis=1)  # close the polygon
+
+    seg, rr, cc = _line_pixels(start[..., 0], start[..., 1], end[..., 0], end[..., 1])
+
+    return seg // pts.shape[1], rr, cc
+
+
+def _get_rng(rng: Optional[np.random.Generator] = None):
+    """Returns `rng`, or the global `np.random` state when no generator is given."""
+    return np.random if rng is None else rng
+
+
+def _integers(rng, low: int, high: int, size=None) -> np.ndarray:
+    """`randint` for both `np.random` and `np.random.Generator`."""
+    if isinstance(rng, np.random.Generator):
+        return rng.integers(low, high, size=size)
+    return rng.randint(low, high, size=size)
+
+
+def _random(rng, size, dtype: np.dtype = np.float64) -> np.ndarray:
+    """Uniform [0, 1) samples.  Generators draw float32 natively, the global state is cast."""
+    if isinstance(rng, np.random.Generator):
+        return rng.random(size, dtype=dtype)
+    return rng.random(size).astype(dtype, copy=False)
+
+
+def _get_pos(
+    s: float, size: Optional[int] = None, rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
+    return _integers(_get_rng(rng), 10, s - 10, size=2 if size is None else (size, 2))
+
 
+def _get_yaw(
+    size: Optional[int] = None, rng: Optional[np.random.Generator] = None
+) -> Union[float, np.ndarray]:
+    return _get_rng(rng).random(size) * 2 * np.pi
 
-def _get_yaw() -> float:
-    return np.random.rand() * 2 * np.pi
 
+def _get_size(
+    size: Optional[int] = None, rng: Optional[np.random.Generator] = None
+) -> Union[int, np.ndarray]:
+    return _integers(_get_rng(rng), 18, 37, size=size)
 
-def _get_size() -> int:
-    return np.random.randint(18, 37)
 
+def _get_l2w(
+    size: Optional[int] = None, rng: Optional[np.random.Generator] = None
+) -> Union[float, np.ndarray]:
+    return abs(_get_rng(rng).normal(3 / 2, 0.2, size=size))
 
-def _get_l2w() -> float:
-    return abs(np.random.normal(3 / 2, 0.2))
 
+def _get_t2l(
+    size: Optional[int] = None, rng: Optional[np.random.Generator] = None
+) -> Union[float, np.ndarray]:
+    return abs(_get_rng(rng).normal(1 / 3, 0.1, size=size))
 
-def _get_t2l() -> float:
-    return abs(np.random.normal(1 / 3, 0.1))
+
+def sample_rng(
+    seed: int,
+    stream: int = 0,
+    index: int = 0,
+    bit_generator: Callable = np.random.PCG64,
+) -> np.random.Generator:
+    """Random generator for sample `index` of stream `stream`.
+
+    Streams are the children of `SeedSequence(seed).spawn` and samples are the children of their
+    stream, so this is the generator of `SeedSequence(seed).spawn(...)[stream].spawn(...)[index]`.
+    It is built directly from the spawn key, which lets any sample be regenerated on its own.
+
+    Args:
+        seed (int): Root seed.
+        stream (int, optional): Stream index, e.g. one per worker. Defaults to 0.
+        index (int, optional): Sample (or batch) index within the stream. Defaults to 0.
+        bit_generator (Callable, optional): Bit generator to use, e.g. `np.random.Philox`. Defaults to `np.random.PCG64`.
+
+    Returns:
+        np.random.Generator: Generator seeded for the requested sample.
+    """
+    seq = np.random.SeedSequence(seed, spawn_key=(stream, index))
+    return np.random.Generator(bit_generator(seq))
+
+
+def make_data_stream(
+    seed: int, stream: int = 0, start: int = 0, **kwargs
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Endless `make_data` samples where sample `i` is drawn with `sample_rng(seed, stream, i)`.
+
+    Args:
+        seed (int): Root seed.
+        stream (int, optional): Stream index. Defaults to 0.
+        start (int, optional): Index of the first sample. Defaults to 0.
+        **kwargs: Passed through to `make_data`.
+
+    Yields:
+        Tuple[np.ndarray, np.ndarray]: Generated Image and the corresponding label.
+    """
+    for index in itertools.count(start):
+        yield make_data(rng=sample_rng(seed, stream, index), **kwargs)
 
 
 def make_data(
@@ -74,6 +246,7 @@ def make_data(
     noise_level: float = 0.8,
     no_lines: int = 6,
     image_size: int = 200,
+    rng: Optional[np.random.Generator] = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """Data generator
 
@@ -82,6 +255,7 @@ def make_data(
         noise_level (float, optional): Level of the background noise. Defaults to 0.8.
         no_lines (int, optional): No. of lines for line noise. Defaults to 6.
         image_size (int, optional): Size of generated image. Defaults to 200.
+        rng (np.random.Generator, optional): Random generator. Defaults to None (global `np.random` state).
 
     Returns:
         Tuple[np.ndarray, np.ndarray]: Generated Image and the corresponding label
@@ -89,30 +263,43 @@ def make_data(
         An empty array is returned when a spaceship is not included.
     """
 
+    rng = _get_rng(rng)
+
     if has_spaceship is None:
-        has_spaceship = np.random.choice([True, False], p=(0.8, 0.2))
+        has_spaceship = rng.choice([True, False], p=(0.8, 0.2))
 
     img = np.zeros(shape=(image_size, image_size))
     label = np.full(5, np.nan)
 
     # draw ship
     if has_spaceship:
-        params = (_get_pos(image_size), _get_yaw(), _get_size(), _get_l2w(), _get_t2l())
+        params = (
+            _get_pos(image_size, rng=rng),
+            _get_yaw(rng=rng),
+            _get_size(rng=rng),
+            _get_l2w(rng=rng),
+            _get_t2l(rng=rng),
+        )
         pts, label = _make_spaceship(*params)
 
-        rr, cc = polygon_perimeter(pts[:, 0], pts[:, 1])
+        _, rr, cc = _perimeter_pixels(pts[None])
         valid = (rr >= 0) & (rr < image_size) & (cc >= 0) & (cc < image_size)
 
-        img[rr[valid], cc[valid]] = np.random.rand(np.sum(valid))
+        img[rr[valid], cc[valid]] = rng.random(np.sum(valid))
 
     # noise lines
     line_noise = np.zeros(shape=(image_size, image_size))
-    for _ in range(no_lines):
-        rr, cc = line(*np.random.randint(0, 200, size=4))
-        line_noise[rr, cc] = np.random.rand(rr.size)
+    ends = np.zeros((no_lines, 4), dtype=int)
+    values = [np.empty(0)]
+    for ii in range(no_lines):
+        ends[ii] = _integers(rng, 0, 200, size=4)
+        values.append(rng.random(_line_length(*ends[ii])))
+
+    _, rr, cc = _line_pixels(*ends.T)
+    line_noise[rr, cc] = np.concatenate(values)
 
     # combined noise
-    noise = noise_level * np.random.rand(image_size, image_size)
+    noise = noise_level * rng.random((image_size, image_size))
     img = np.stack([img, noise, line_noise], axis=0).max(axis=0)
 
     img = img.T  # ensure image space matches with coordinate space
@@ -120,6 +307,86 @@ def make_data(
     return img, label
 
 
+def make_data_batch(
+    batch_size: int,
+    has_spaceship: Union[bool, None] = None,
+    noise_level: float = 0.8,
+    no_lines: int = 6,
+    image_size: int = 200,
+    rng: Optional[np.random.Generator] = None,
+    dtype: np.dtype = np.float64,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batched data generator.  Samples from the same distribution as `make_data`, but draws every
+    ship perimeter and noise line of the batch into one (N, H, W) buffer with a single scatter.
+
+    Args:
+        batch_size (int): Number of images to generate.
+        has_spaceship (bool, optional): Whether a spaceship is included. Defaults to None (randomly sampled per image).
+        noise_level (float, optional): Level of the background noise. Defaults to 0.8.
+        no_lines (int, optional): No. of lines for line noise. Defaults to 6.
+        image_size (int, optional): Size of generated image. Defaults to 200.
+        rng (np.random.Generator, optional): Random generator. Defaults to None (global `np.random` state).
+        dtype (np.dtype, optional): Image dtype.  Generators draw float32 pixels natively. Defaults to np.float64.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (N, H, W) images and the (N, 5) labels.
+        Label rows are NaN for images without a spaceship.
+    """
+
+    rng = _get_rng(rng)
+
+    if has_spaceship is None:
+        has_spaceship = rng.choice([True, False], size=batch_size, p=(0.8, 0.2))
+
+    ships = np.flatnonzero(np.broadcast_to(has_spaceship, (batch_size,)))
+    labels = np.full((batch_size, 5), np.nan)
+    plane = image_size * image_size
+
+    # images are written transposed, i.e. pixel (rr, cc) lands at [cc, rr] like `make_data`
+    imgs = np.zeros((batch_size, image_size, image_size), dtype=dtype)
+
+    # draw ships
+    n = ships.size
+    pts, labels[ships] = _make_spaceships(
+        _get_pos(image_size, n, rng=rng),
+        _get_yaw(n, rng=rng),
+        _get_size(n, rng=rng),
+        _get_l2w(n, rng=rng),
+        _get_t2l(n, rng=rng),
+    )
+    idx, rr, cc = _perimeter_pixels(pts)
+    valid = (rr >= 0) & (rr < image_size) & (cc >= 0) & (cc < image_size)
+    flat = ships[idx[valid]] * plane + cc[valid] * image_size + rr[valid]
+    imgs.reshape(-1)[flat] = _random(rng, flat.size, dtype)
+
+    _add_noise(imgs, noise_level, no_lines, rng)
+
+    return imgs, labels
+
+
+def _add_noise(imgs: np.ndarray, noise_level: float, no_lines: int, rng) -> np.ndarray:
+    """Draws the noise lines and the background noise of `make_data_batch` over (N, H, W) images."""
+    batch_size, image_size, _ = imgs.shape
+    plane = image_size * image_size
+    dtype = imgs.dtype
+    line_noise = np.zeros_like(imgs)
+
+    # noise lines
+    ends = _integers(rng, 0, 200, size=(batch_size * no_lines, 4))
+    idx, rr, cc = _line_pixels(*ends.T)
+    valid = (rr < image_size) & (cc < image_size)
+    flat = idx[valid] // no_lines * plane + cc[valid] * image_size + rr[valid]
+    line_noise.reshape(-1)[flat] = _random(rng, flat.size, dtype)
+
+    # combined noise
+    noise = _random(rng, (batch_size, image_size, image_size), dtype)
+    noise *= noise_level
+    np.maximum(imgs, line_noise, out=imgs)
+    np.maximum(imgs, noise, out=imgs)
+
+    return imgs
+
+
 def analyze(ypred: np.ndarray, ytrue: np.ndarray) -> Optional[str]:
     assert (
         ypred.size == ytrue.size == 5
@@ -179,3 +446,113 @@ def score_iou(ypred: np.ndarray, ytrue: np.ndarray) -> Optional[float]:
         return 0
     else:
         raise NotImplementedError
+
+
+OUTCOMES = ("TN", "FP", "FN", "IOU-GOOD", "IOU-BAD")
+TN, FP, FN, IOU_GOOD, IOU_BAD = range(len(OUTCOMES))
+
+
+def _shapely_ious(pairs: np.ndarray) -> np.ndarray:
+    """IOUs of (prediction, label) pairs, the prediction once as is and once with the label yaw.
+
+    Args:
+        pairs (np.ndarray): (N, 2, 5) predictions and labels.
+
+    Returns:
+        np.ndarray: (N, 2) IOUs as computed by `score_iou` and by `analyze`.
+    """
+    ious = np.empty((len(pairs), 2))
+    for ii, (ypred, ytrue) in enumerate(pairs):
+        t = Polygon(_make_box_pts(*ytrue))
+        for jj, yaw in enumerate((ypred[2], ytrue[2])):
+            if jj and yaw == ypred[2]:
+                ious[ii, jj] = ious[ii, 0]
+                continue
+            p = Polygon(_make_box_pts(*ypred[:2], yaw, *ypred[3:]))
+            ious[ii, jj] = t.intersection(p).area / t.union(p).area
+
+    return ious
+
+
+# Shapely worker pools by number of processes, kept until `close_pools` or interpreter exit
+_pools = {}
+
+
+def _shapely_pool(processes: Optional[int] = None):
+    """Shared spawn pool, started on first use so that later calls skip the worker start-up."""
+    if processes not in _pools:
+        _pools[processes] = mp.get_context("spawn").Pool(processes)
+    return _pools[processes]
+
+
+@atexit.register
+def close_pools():
+    """Shuts down the worker pools shared by `score_batch`, they are restarted on the next use."""
+    while _pools:
+        _, pool = _pools.popitem()
+        pool.close()
+        pool.join()
+
+
+def score_batch(
+    ypred: np.ndarray,
+    ytrue: np.ndarray,
+    threshold: float = 0.7,
+    processes: Optional[int] = None,
+    chunk_size: int = 256,
+    pool=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """`score_iou` and `analyze` of a whole batch.
+
+    TN, FP and FN, and boxes whose bounding circles do not overlap, are scored with NumPy.  Only the
+    remaining pairs go through Shapely, split into chunks across a process pool, so the IOUs are
+    exactly those of `score_iou`.  Unlike `analyze`, the inputs are not modified, so a prediction
+    on an image without a spaceship is always a false positive.
+
+    Args:
+        ypred (np.ndarray): (N, 5) predicted parameters, NaN rows for empty predictions.
+        ytrue (np.ndarray): (N, 5) labels, NaN rows for images without a spaceship.
+        threshold (float, optional): IOU above which a detection is "IOU-GOOD". Defaults to 0.7.
+        processes (int, optional): Processes of the shared Shapely pool, 1 scores in process. Defaults to None (one per core).
+        chunk_size (int, optional): Pairs per worker task, batches up to this size are scored in process. Defaults to 256.
+        pool (optional): Caller-owned `multiprocessing.Pool` or `concurrent.futures` executor used instead of the shared pool. Defaults to None (shared pool, shut down by `close_pools` or at exit).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (N,) IOUs, NaN for true negatives, and (N,) int8 outcomes,
+        indices into `OUTCOMES`.
+    """
+    ypred = np.asarray(ypred, dtype=float).reshape(-1, 5)
+    ytrue = np.asarray(ytrue, dtype=float).reshape(-1, 5)
+    assert ypred.shape == ytrue.shape, "Predictions and labels should have the same shape."
+
+    no_pred = np.isnan(ypred).any(axis=1)
+    no_label = np.isnan(ytrue).any(axis=1)
+    both = ~no_pred & ~no_label
+
+    outcomes = np.full(len(ypred), IOU_BAD, dtype=np.int8)
+    outcomes[no_pred & no_label] = TN
+    outcomes[~no_pred & no_label] = FP
+    outcomes[no_pred & ~no_label] = FN
+
+    # IOU and the yaw-agnostic IOU of `analyze`
+    ious = np.zeros((len(ypred), 2))
+    ious[no_pred & no_label] = np.nan
+
+    # boxes are disjoint when their bounding circles are, the IOU is then 0 unless both are empty
+    radius = np.hypot(ypred[:, 3], ypred[:, 4]) / 2 + np.hypot(ytrue[:, 3], ytrue[:, 4]) / 2
+    distance = np.hypot(ypred[:, 0] - ytrue[:, 0], ypred[:, 1] - ytrue[:, 1])
+    area = ypred[:, 3] * ypred[:, 4] + ytrue[:, 3] * ytrue[:, 4]
+    with np.errstate(invalid="ignore"):
+        overlapping = both & ~((distance > radius) & (area > 0))
+
+    pairs = np.stack([ypred[overlapping], ytrue[overlapping]], axis=1)
+    if (pool is None and processes == 1) or len(pairs) <= chunk_size:
+        ious[overlapping] = _shapely_ious(pairs)
+    else:
+        pool = pool or _shapely_pool(processes)
+        chunks = np.array_split(pairs, -(-len(pairs) // chunk_size))
+        ious[overlapping] = np.concatenate(list(pool.map(_shapely_ious, chunks)))
+
+    outcomes[both & (ious[:, 1] > threshold)] = IOU_GOOD
+
+    return ious[:, 0], outcomes
@@ -1,18 +1,34 @@
+from typing import List
+from typing import Optional
+from typing import Union
+
 import numpy as np
 from tensorflow import keras
 from tqdm import tqdm
 
+from src.corpus import cached_outputs
+from src.corpus import Corpus
+from src.corpus import load_corpus
 from src.helpers import analyze
 from src.helpers import make_data
 from src.helpers import score_iou
+from src.memprof import MemoryProfiler
+from src.memprof import stage
+from src.model_cache import load_cached_model
+from src.runtime import configure
+from src.runtime import RuntimeConfig
 from src.train import normalization
 
+# output order of `make_batch`
+VARIABLES = ["x", "y", "yaw", "width", "height", "sin", "cos", "detection"]
+
 
-def post_processing(predictions: np.ndarray) -> np.ndarray:
+def post_processing(predictions: np.ndarray, threshold: Optional[float] = 0.0) -> np.ndarray:
     """Performs conversions from the model to values expected by the evaluation algorithm.
 
     Args:
         predictions (np.ndarray): Predictions from model.
+        threshold (float, optional): Detection scores at or below this mean no spaceship, None keeps every prediction. Defaults to 0.0.
 
     Returns:
         np.ndarray: Predictions after post-processing.
@@ -21,7 +37,7 @@ def post_processing(predictions: np.ndarray) -> np.ndarray:
     names = ["x", "y", "width", "height", "sin", "cos", "detection"]
 
     # return nan if no object in image
-    if predictions[0][0][0] <= 0:
+    if threshold is not None and predictions[0][0][0] <= threshold:
         array = np.zeros((1, 5))
         array[:] = np.nan
         return array
@@ -55,33 +71,269 @@ def post_processing(predictions: np.ndarray) -> np.ndarray:
     return array
 
 
-def eval():
-    # load the proper models for this evaluation
-    model = keras.models.load_model("save/best_combined_model")
+def post_processing_batch(
+    predictions: List[np.ndarray], threshold: Optional[float] = 0.0
+) -> np.ndarray:
+    """Applies `post_processing` to every sample of a batch of model outputs.
 
-    ious = []
-    analysis = []
-    deltas = []
+    Args:
+        predictions (List[np.ndarray]): One (N, k) array per model output.
+        threshold (float, optional): Detection threshold, see `post_processing`. Defaults to 0.0.
+
+    Returns:
+        np.ndarray: (N, 5) predicted parameters, NaN where nothing was detected.
+    """
+
+    preds = [
+        post_processing([p[ii : ii + 1] for p in predictions], threshold)
+        for ii in range(len(predictions[0]))
+    ]
+
+    return np.concatenate(preds)
+
+
+def head_predictions(outputs: np.ndarray, labels: np.ndarray, variables: List[str]) -> np.ndarray:
+    """Parameters predicted by a single head, with the ones it does not predict taken from the labels.
+
+    Args:
+        outputs (np.ndarray): (N, k) raw head outputs.
+        labels (np.ndarray): (N, 5) labels.
+        variables (List[str]): Variables the head was trained on, see `make_batch`.
+
+    Returns:
+        np.ndarray: (N, 5) predicted parameters.
+    """
+    names = [name for name in VARIABLES if name in variables]  # outputs follow `make_batch`
+    outputs = dict(zip(names, outputs.T))
+    preds = labels.copy()
+
+    # fmt: off
+    if "x" in outputs:
+        preds[:, 0] = normalization(min_x=-1, max_x=1, inputs=outputs["x"],      tgt_min=10, tgt_max=190)
+    if "y" in outputs:
+        preds[:, 1] = normalization(min_x=-1, max_x=1, inputs=outputs["y"],      tgt_min=10, tgt_max=190)
+    if "sin" in outputs:
+        preds[:, 2] = np.arctan2(outputs["sin"], outputs["cos"]) % (2 * np.pi)
+    if "width" in outputs:
+        preds[:, 3] = normalization(min_x=-1, max_x=1, inputs=outputs["width"],  tgt_min=18, tgt_max=36)
+    if "height" in outputs:
+        preds[:, 4] = normalization(min_x=-1, max_x=1, inputs=outputs["height"], tgt_min=18, tgt_max=75)
+    # fmt: on
+
+    if "detection" in outputs:
+        detected = outputs["detection"] > 0
+        preds[detected & np.isnan(labels[:, 0])] = 0  # any prediction is a false positive
+        preds[~detected] = np.nan
+
+    return preds
+
+
+def predict(model: keras.Model, imgs: np.ndarray, batch_size: int = 64) -> np.ndarray:
+    """Runs batched inference and post-processes every prediction.
+
+    Args:
+        model (keras.Model): Combined model.
+        imgs (np.ndarray): (N, 200, 200) images as produced by `make_data`.
+        batch_size (int, optional): Inference batch size. Defaults to 64.
+
+    Returns:
+        np.ndarray: (N, 5) predicted parameters, NaN where nothing was detected.
+    """
+
+    predictions = model.predict(2 * imgs - 1, batch_size=batch_size)
+
+    return post_processing_batch(predictions)
+
+
+def average_precision(preds: np.ndarray, labels: np.ndarray, threshold: float = 0.7) -> float:
+    """AP at an IOU threshold, the metric reported by `eval`.
+
+    Args:
+        preds (np.ndarray): (N, 5) predicted parameters.
+        labels (np.ndarray): (N, 5) labels.
+        threshold (float, optional): IOU threshold. Defaults to 0.7.
+
+    Returns:
+        float: Fraction of images that are not true negatives with an IOU above the threshold.
+    """
+
+    ious = [score_iou(label, pred) for label, pred in zip(labels, preds)]
+    ious = np.asarray(ious, dtype="float")
+    ious = ious[~np.isnan(ious)]  # remove true negatives
 
-    for _ in tqdm(range(1000)):
-        img, label = make_data()
+    return (ious > threshold).mean()
 
-        # perform pre-processing
-        img = 2 * img - 1
 
-        predictions = model.predict(img[None])
+def threshold_sweep(scores: np.ndarray, ious: np.ndarray, iou_threshold: float = 0.7) -> dict:
+    """Outcome counts, AP and the precision-recall curve at every detection threshold in one pass.
 
-        # perform post-processing on predictions
-        pred = post_processing(predictions)
+    An image is detected when its score is above the threshold.  Outcomes follow `analyze`: "TN" and
+    "FP" for images without a spaceship, "FN", "IOU-GOOD" and "IOU-BAD" for images with one.  Sorting
+    the scores once turns the counts at every threshold into cumulative sums.
+
+    Args:
+        scores (np.ndarray): (N,) raw detection scores.
+        ious (np.ndarray): (N,) IOU of the prediction with the label regardless of the score, NaN for images without a spaceship.
+        iou_threshold (float, optional): IOU above which a detection is good. Defaults to 0.7.
+
+    Returns:
+        dict: "threshold", descending from the highest score (nothing detected) to -inf (everything
+        detected), the count of every outcome, "ap" (the `eval` metric), "precision" and "recall"
+        at every threshold, and "pr_auc", the area under the precision-recall curve.
+    """
+
+    positive = ~np.isnan(ious)
+    good = positive & (np.nan_to_num(ious) > iou_threshold)
+
+    order = np.argsort(-scores, kind="stable")
+    sorted_scores = scores[order]
+
+    # last index of every run of tied scores, the detections at threshold j are the first j runs
+    ends = np.flatnonzero(np.diff(sorted_scores, append=-np.inf))
+    detected = np.concatenate([[0], ends + 1])
+    detected_positive = np.concatenate([[0], np.cumsum(positive[order])[ends]])
+    detected_good = np.concatenate([[0], np.cumsum(good[order])[ends]])
+
+    n_positive = int(positive.sum())
+    n_negative = len(scores) - n_positive
+
+    sweep = {
+        "threshold": np.concatenate([sorted_scores[ends], [-np.inf]]),
+        "TN": n_negative - (detected - detected_positive),
+        "FP": detected - detected_positive,
+        "FN": n_positive - detected_positive,
+        "IOU-GOOD": detected_good,
+        "IOU-BAD": detected_positive - detected_good,
+    }
+
+    scored = len(scores) - sweep["TN"]  # true negatives are excluded from the AP
+    sweep["ap"] = detected_good / np.maximum(scored, 1)
+    sweep["precision"] = np.where(detected > 0, detected_good / np.maximum(detected, 1), 1.0)
+    sweep["recall"] = detected_good / max(n_positive, 1)
+    sweep["pr_auc"] = float(np.sum(np.diff(sweep["recall"]) * sweep["precision"][1:]))
+
+    return sweep
+
+
+def operating_point(sweep: dict, threshold: float) -> int:
+    """Index of `threshold_sweep` results that detects the images with a score above `threshold`."""
+    return int(np.argmax(sweep["threshold"] <= threshold))
+
+
+def eval_thresholds(
+    model_path: str = "save/best_combined_model",
+    corpus: str = "v1",
+    iou_threshold: float = 0.7,
+    plot_path: Optional[str] = None,
+) -> dict:
+    """Evaluates a model at every detection threshold from a single inference run.
+
+    The raw detection scores and the IOUs of the uncut predictions are kept with the sweep, so
+    other thresholds can be read off without rerunning the evaluation.
+
+    Args:
+        model_path (str, optional): Path of the combined model, or of a distilled student. Defaults to "save/best_combined_model".
+        corpus (str, optional): Version of the evaluation corpus. Defaults to "v1".
+        iou_threshold (float, optional): IOU above which a detection is good. Defaults to 0.7.
+        plot_path (str, optional): Where to save the precision-recall curve. Defaults to None (no plot).
+
+    Returns:
+        dict: `threshold_sweep` results with the "scores" and "ious" of every image.
+    """
+
+    data = load_corpus(corpus)
+    outputs = cached_outputs(model_path, data)
+
+    scores = outputs[0][:, 0]
+    preds = post_processing_batch(outputs, threshold=None)
+    ious = np.array(
+        [
+            score_iou(label, pred) if not np.isnan(label).any() else np.nan
+            for label, pred in zip(data.labels, preds)
+        ],
+        dtype="float",
+    )
+
+    sweep = threshold_sweep(scores, ious, iou_threshold)
+    sweep["scores"] = scores
+    sweep["ious"] = ious
+
+    outcomes = ["TN", "FP", "FN", "IOU-GOOD", "IOU-BAD", "ap", "precision", "recall"]
+    best = int(np.argmax(sweep["ap"]))
+    print(f"{'':>10} {'threshold':>10} " + " ".join(f"{name:>9}" for name in outcomes))
+    for name, index in [("default", operating_point(sweep, 0.0)), ("best AP", best)]:
+        values = " ".join(f"{sweep[outcome][index]:>9.3g}" for outcome in outcomes)
+        print(f"{name:>10} {sweep['threshold'][index]:>10.4g} {values}")
+    print(f"PR AUC: {sweep['pr_auc']:.3f}")
+
+    if plot_path is not None:
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots(figsize=(5, 5))
+        ax.plot(sweep["recall"], sweep["precision"], drawstyle="steps-post")
+        ax.set_xlabel("recall")
+        ax.set_ylabel("precision")
+        ax.set_title(f"IOU > {iou_threshold}")
+        fig.savefig(plot_path)
+        plt.close(fig)
+
+    return sweep
+
+
+def eval(
+    model_path: str = "save/best_combined_model",
+    runtime: Optional[RuntimeConfig] = None,
+    corpus: Optional[Union[str, Corpus]] = "v1",
+    profiler: Optional[MemoryProfiler] = None,
+):
+    """Reports AP@0.7 and the outcome statistics of a model on the frozen evaluation corpus, or on
+    fresh `make_data` samples.
+
+    Model outputs on a corpus are cached per model artifact and corpus, so re-scoring an unchanged
+    model skips inference.
+
+    Args:
+        model_path (str, optional): Path of the combined model, or of a distilled student. Defaults to "save/best_combined_model".
+        runtime (RuntimeConfig, optional): Threading and core pinning. Defaults to None (TensorFlow defaults).
+        corpus (Union[str, Corpus], optional): Evaluation corpus or its version, built with 1000 samples on first use, None scores 1000 fresh full-precision samples. Defaults to "v1".
+        profiler (MemoryProfiler, optional): Records the memory of every stage, inference then bypasses the output cache. Defaults to None.
+    """
+    if runtime is not None:
+        configure(runtime)
+
+    if corpus is None:
+        imgs, labels = map(np.stack, zip(*(make_data() for _ in range(1000))))
+        data = Corpus("fresh", imgs, labels, digest="")
+    elif isinstance(corpus, str):
+        data = load_corpus(corpus)
+    else:
+        data = corpus
+    n = len(data)
+
+    if profiler is None and corpus is not None:
+        outputs = cached_outputs(model_path, data)
+    else:
+        with stage(profiler, "load_model"):
+            model = load_cached_model(model_path)
+        with stage(profiler, "inference", n):
+            outputs = model.predict(2 * data.imgs.astype(np.float32) - 1, batch_size=64)
+
+    with stage(profiler, "post_processing", n):
+        preds = post_processing_batch(outputs)
+
+    ious = []
+    analysis = []
+    deltas = []
 
-        pred = np.squeeze(pred)
-        ious.append(score_iou(label, pred))
+    with stage(profiler, "scoring", n):
+        for label, pred in zip(tqdm(data.labels), preds):
+            ious.append(score_iou(label, pred))
 
-        # analysis tracker
-        analysis.append(analyze(label, pred))
+            # analysis tracker
+            analysis.append(analyze(pred.copy(), label.copy()))
 
-        # track the delta
-        deltas.append(label - pred)
+            # track the delta
+            deltas.append(label - pred)
 
     ious = np.asarray(ious, dtype="float")
     ious = ious[~np.isnan(ious)]  # remove true negatives
@@ -0,0 +1,272 @@
+"""
+Memory profiling of the data generation and evaluation stages.  Every stage records its peak RSS,
+the peak and net Python allocations with their top allocation sites from tracemalloc, and the
+TensorFlow allocator stats, and stages run at several sizes N are flagged when their memory grows
+with N.  TensorFlow only reports allocator stats for GPUs, from TF 2.4 on, so on CPU hosts the RSS
+is the only measure of the TensorFlow memory and the report says why the stats are missing.
+"""
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+
+def _rss() -> Tuple[int, int]:
+    """Current and peak resident set size in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(status["VmRSS"].split()[0]) * 1024, int(status["VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError):
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024
+        return peak, peak
+
+
+def _reset_peak_rss() -> bool:
+    """Resets the peak RSS of the process, only possible on Linux."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _tf_memory() -> Tuple[Optional[Dict[str, int]], Optional[str]]:
+    """Allocator stats of the first GPU, and why they are missing when TensorFlow is in use."""
+    tf = sys.modules.get("tensorflow")
+    if tf is None:
+        return None, None
+    if not tf.config.list_logical_devices("GPU"):
+        return None, "TensorFlow has no allocator stats for the CPU"
+
+    experimental = tf.config.experimental
+    try:
+        if hasattr(experimental, "get_memory_info"):
+            return dict(experimental.get_memory_info("GPU:0"), device="GPU:0"), None
+        if hasattr(experimental, "get_memory_usage"):  # TF 2.4 only has the current usage
+            return {"current": experimental.get_memory_usage("GPU:0"), "device": "GPU:0"}, None
+    except ValueError as e:
+        return None, str(e)
+    return None, f"TensorFlow {tf.__version__} has no allocator stats"
+
+
+@dataclass
+class StageRecord:
+    """Memory of a single run of a stage, sizes in bytes.
+
+    Args:
+        name (str): Name of the stage.
+        n (int): Number of samples processed by the stage.
+        seconds (float): Wall time.
+        rss_peak (int): Peak RSS during the stage above the RSS at the start.  Where the peak cannot be reset it is the process peak above the RSS at the start, and 0 when the stage stayed below an earlier peak.
+        rss_delta (int): RSS at the end minus RSS at the start.
+        py_peak (int): Peak Python allocations above the allocations at the start.
+        py_net (int): Python allocations still alive at the end.
+        tf_memory (dict, optional): TensorFlow allocator stats of the GPU at the end. Defaults to None (TensorFlow not in use or no stats, see `MemoryProfiler.tf_memory_gaps`).
+        top_sites (List[str], optional): Sites with the largest net allocations. Defaults to [].
+    """
+
+    name: str
+    n: int
+    seconds: float
+    rss_peak: int
+    rss_delta: int
+    py_peak: int
+    py_net: int
+    tf_memory: Optional[dict] = None
+    top_sites: List[str] = field(default_factory=list)
+
+
+class MemoryProfiler:
+    """Records the memory of named stages.
+
+    Python 3.8 cannot reset the tracemalloc peak, so there the peak of a stage is the peak since
+    the previous stage.  tracemalloc slows down every allocation, so the profiler stops it on
+    `close` when it started it.  Where TensorFlow has no allocator stats, on CPU hosts and before
+    TF 2.4, the reasons are collected in `tf_memory_gaps` and printed with the report.
+
+    Args:
+        top (int, optional): Allocation sites kept per stage. Defaults to 5.
+        frames (int, optional): Stack frames stored per allocation. Defaults to 1.
+    """
+
+    def __init__(self, top: int = 5, frames: int = 1):
+        self.top = top
+        self.records = []
+        self.tf_memory_gaps = []
+
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start(frames)
+
+    def close(self):
+        if self.started and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.started = False
+
+    def __enter__(self) -> "MemoryProfiler":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, n: int = 0):
+        """Context manager recording a stage.
+
+        Args:
+            name (str): Name of the stage.
+            n (int, optional): Number of samples processed by the stage. Defaults to 0.
+        """
+        _reset_peak_rss()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        rss_start, _ = _rss()
+        py_start, _ = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+
+        yield
+
+        seconds = time.perf_counter() - start
+        py_end, py_peak = tracemalloc.get_traced_memory()
+        rss_end, rss_peak = _rss()
+        stats = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+        tf_memory, gap = _tf_memory()
+        if gap is not None and gap not in self.tf_memory_gaps:
+            self.tf_memory_gaps.append(gap)
+
+        self.records.append(
+            StageRecord(
+                name=name,
+                n=n,
+                seconds=seconds,
+                rss_peak=max(0, rss_peak - rss_start),
+                rss_delta=rss_end - rss_start,
+                py_peak=py_peak - py_start,
+                py_net=py_end - py_start,
+                tf_memory=tf_memory,
+                top_sites=[str(stat) for stat in stats[: self.top]],
+            )
+        )
+
+    def growth(self, threshold: float = 0.5, min_bytes: int = 2**20) -> Dict[str, dict]:
+        """Fits the peak Python allocations of every stage linearly in N.
+
+        Args:
+            threshold (float, optional): A stage is flagged when the part growing with N is more than this fraction of its peak at the largest N. Defaults to 0.5.
+            min_bytes (int, optional): Stages peaking below this at the largest N are never flagged. Defaults to 1 MiB.
+
+        Returns:
+            Dict[str, dict]: "bytes_per_sample" and "flagged" of every stage run at two or more sizes.
+        """
+        stages = {}
+        for name in dict.fromkeys(record.name for record in self.records):
+            records = [record for record in self.records if record.name == name]
+            ns = np.array([record.n for record in records], dtype=float)
+            peaks = np.array([record.py_peak for record in records], dtype=float)
+            if len(np.unique(ns)) < 2:
+                continue
+
+            slope, _ = np.polyfit(ns, peaks, 1)
+            largest = peaks[np.argmax(ns)]
+            stages[name] = {
+                "bytes_per_sample": float(slope),
+                "flagged": bool(largest >= min_bytes and slope * ns.max() > threshold * largest),
+            }
+
+        return stages
+
+    def report(self, path: Optional[str] = None, threshold: float = 0.5) -> dict:
+        """Prints a summary of every stage and writes the full report as JSON.
+
+        Args:
+            path (str, optional): Path of the JSON report. Defaults to None (not written).
+            threshold (float, optional): Growth threshold, see `growth`. Defaults to 0.5.
+
+        Returns:
+            dict: "stages", the records of every stage run, "growth" and "tf_memory_gaps".
+        """
+        growth = self.growth(threshold)
+        report = {
+            "stages": [asdict(record) for record in self.records],
+            "growth": growth,
+            "tf_memory_gaps": self.tf_memory_gaps,
+        }
+
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+        mb = 1 / 2**20
+        print(
+            f"{'stage':<16} {'N':>6} {'seconds':>8} {'RSS peak':>9} "
+            f"{'py peak':>9} {'py net':>9} {'MB/1k N':>8}"
+        )
+        for record in self.records:
+            per_sample = growth.get(record.name, {}).get("bytes_per_sample", float("nan"))
+            flag = " <- grows with N" if growth.get(record.name, {}).get("flagged") else ""
+            print(
+                f"{record.name:<16} {record.n:>6} {record.seconds:>8.2f} "
+                f"{record.rss_peak * mb:>9.1f} {record.py_peak * mb:>9.1f} "
+                f"{record.py_net * mb:>9.1f} {per_sample * 1000 * mb:>8.1f}{flag}"
+            )
+        for gap in self.tf_memory_gaps:
+            print(f"TensorFlow memory not recorded: {gap}, see the RSS columns")
+
+        return report
+
+
+def stage(profiler: Optional[MemoryProfiler], name: str, n: int = 0):
+    """`profiler.stage`, or a no-op without a profiler."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, n)
+
+
+def main(
+    model_path: str = "save/best_combined_model",
+    sizes: Tuple[int, ...] = (64, 256, 1024),
+    report_dir: str = "save/profile",
+):
+    """Profiles `make_batch` and `eval` at several sizes and writes a report.
+
+    Args:
+        model_path (str, optional): Path of the combined model. Defaults to "save/best_combined_model".
+        sizes (Tuple[int, ...], optional): Batch sizes of `make_batch` and sample counts of `eval`. Defaults to (64, 256, 1024).
+        report_dir (str, optional): Directory of the reports. Defaults to "save/profile".
+    """
+    from src.corpus import build_corpus
+    from src.main import eval
+    from src.train import make_batch
+
+    with MemoryProfiler() as profiler:
+        for n in sizes:
+            make_batch(batch_size=n, has_spaceship=None, profiler=profiler)
+
+        for n in sizes:
+            with profiler.stage("build_corpus", n):
+                corpus = build_corpus(f"profile-{n}", no_samples=n, root=None)
+            eval(model_path, corpus=corpus, profiler=profiler)
+
+        profiler.report(f"{report_dir}/memory-{time.strftime('%Y%m%d-%H%M%S')}.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Process-level cache of deserialized models.  Entries are keyed on the path and on either the latest
+modification time or a content hash of the saved files, so a checkpoint that is overwritten on disk
+is loaded again.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+from tensorflow import keras
+
+
+def _files(path: str) -> list:
+    """Files of a saved model, a single file for HDF5 or every file of a SavedModel directory."""
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+
+
+def fingerprint(path: str, key: str = "mtime") -> Tuple:
+    """Identifies the saved files of a model by their modification times and sizes, or by a SHA-1
+    of their contents when `key` is "hash"."""
+    files = _files(path)
+
+    if key == "mtime":
+        return tuple((f, os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in files)
+
+    digest = hashlib.sha1()
+    for f in files:
+        digest.update(os.path.relpath(f, path).encode())
+        with open(f, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                digest.update(chunk)
+    return (digest.hexdigest(),)
+
+
+def clone_model(model: keras.Model) -> keras.Model:
+    """Copy of a model with new layer objects and the same weights."""
+    copy = keras.models.clone_model(model)
+    copy.set_weights(model.get_weights())
+    return copy
+
+
+class ModelCache:
+    """LRU cache of loaded models.
+
+    Cached models are shared, so callers that rename, rewire or train layers, e.g. `replace_inputs`
+    or the `gen_*` heads, must ask for a clone.
+
+    Args:
+        maxsize (int, optional): Maximum number of cached models. Defaults to 8.
+        key (str, optional): Either "mtime" (modification times and sizes) or "hash" (file contents). Defaults to "mtime".
+    """
+
+    def __init__(self, maxsize: int = 8, key: str = "mtime"):
+        if key not in ("mtime", "hash"):
+            raise ValueError(f"Unknown cache key: {key}")
+
+        self.maxsize = maxsize
+        self.key = key
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def load(self, path: str, clone: bool = False) -> keras.Model:
+        """Loads a model, deserializing it only when it is not cached or changed on disk.
+
+        Args:
+            path (str): Path of a SavedModel directory or an HDF5 file.
+            clone (bool, optional): Return a copy that is safe to mutate. Defaults to False.
+
+        Returns:
+            keras.Model: The loaded model.
+        """
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No saved model at {path}")
+
+        stamp = fingerprint(path, self.key)
+
+        with self.lock:
+            entry = self.models.get(path)
+            if entry is not None and entry[0] == stamp:
+                self.models.move_to_end(path)
+                self.hits += 1
+                model = entry[1]
+            else:
+                self.misses += 1
+                model = keras.models.load_model(path)
+                self.models[path] = (stamp, model)
+                self.models.move_to_end(path)
+                while len(self.models) > self.maxsize:
+                    self.models.popitem(last=False)
+
+        return clone_model(model) if clone else model
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+
+
+cache = ModelCache()
+
+
+def load_cached_model(path: str, clone: bool = False) -> keras.Model:
+    """Loads a model through the process-level cache.
+
+    Args:
+        path (str): Path of a SavedModel directory or an HDF5 file.
+        clone (bool, optional): Return a copy that is safe to mutate. Defaults to False.
+
+    Returns:
+        keras.Model: The loaded model.
+    """
+    return cache.load(path, clone=clone)
@@ -0,0 +1,153 @@
+"""
+Training-time AP@0.7.  At the end of every epoch the weights are snapshotted and scored on a fixed
+validation set by a background thread, so training does not wait for inference and IOU scoring, and
+the scores drive checkpoint selection and early stopping in place of the training loss.
+"""
+import queue
+import threading
+from typing import List
+from typing import Optional
+
+import numpy as np
+from tensorflow import keras
+
+from src.main import average_precision
+from src.main import head_predictions
+from src.main import post_processing_batch
+from src.model_cache import clone_model
+
+_DONE = object()
+
+
+class BackgroundAP(keras.callbacks.Callback):
+    """Custom Keras callback scoring the AP of every epoch on a background thread.
+
+    The worker scores a copy of the model, so it never touches the weights being trained.  When it
+    falls behind, a new snapshot replaces the one still waiting and the stale epoch is skipped.
+    Scores arrive an epoch or more late, so the model saved at `filepath` is the best scored
+    snapshot, not the latest weights, and early stopping counts scored epochs.  The latest score is
+    logged as "val_ap_lagged", it belongs to an earlier epoch, so other callbacks must not monitor it.
+
+    Args:
+        imgs (np.ndarray): Raw validation images.
+        labels (np.ndarray): Validation labels.
+        variables (List[str], optional): Variables a single head was trained on, see `head_predictions`. Defaults to None (combined model).
+        filepath (str, optional): Where to save the model of the best AP. Defaults to None (not saved).
+        patience (int, optional): Scored epochs without improvement before training stops. Defaults to None (never stops).
+        threshold (float, optional): IOU threshold of the AP. Defaults to 0.7.
+        batch_size (int, optional): Inference batch size. Defaults to 64.
+        restore_best_weights (bool, optional): Load the best scored weights at the end of training. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        imgs: np.ndarray,
+        labels: np.ndarray,
+        variables: Optional[List[str]] = None,
+        filepath: Optional[str] = None,
+        patience: Optional[int] = None,
+        threshold: float = 0.7,
+        batch_size: int = 64,
+        restore_best_weights: bool = False,
+    ):
+        super().__init__()
+        self.inputs = 2 * np.asarray(imgs, dtype=np.float32) - 1
+        self.labels = labels
+        self.variables = variables
+        self.filepath = filepath
+        self.patience = patience
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.restore_best_weights = restore_best_weights
+
+        self.scores = {}
+        self.skipped = []
+        self.best = -np.inf
+        self.best_epoch = None
+        self.best_weights = None
+        self.stopped_epoch = None
+        self.lock = threading.Lock()
+
+    def on_train_begin(self, logs=None):
+        self.snapshots = queue.Queue(1)
+        self.error = None
+        self.wait = 0
+        self.worker = threading.Thread(
+            target=self._work, args=(clone_model(self.model),), daemon=True
+        )
+        self.worker.start()
+
+    def on_epoch_end(self, epoch, logs=None):
+        snapshot = (epoch, self.model.get_weights())
+        try:
+            self.snapshots.put_nowait(snapshot)
+        except queue.Full:
+            try:
+                stale, _ = self.snapshots.get_nowait()
+                self.skipped.append(stale)
+            except queue.Empty:
+                pass
+            self.snapshots.put_nowait(snapshot)
+
+        with self.lock:
+            if self.error is not None:
+                raise self.error
+            if self.scores and logs is not None:
+                logs["val_ap_lagged"] = self.scores[max(self.scores)]
+            if self.stopped_epoch is not None:
+                self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        # scores the last snapshot, unless the worker died with it queued
+        while self.worker.is_alive():
+            try:
+                self.snapshots.put(_DONE, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.worker.join()
+
+        if self.error is not None:
+            raise self.error
+        if self.restore_best_weights and self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+    def score(self, model: keras.Model) -> float:
+        """AP of a model on the validation set."""
+        outputs = [
+            model(self.inputs[ii : ii + self.batch_size], training=False)
+            for ii in range(0, len(self.inputs), self.batch_size)
+        ]
+
+        if self.variables is None:
+            outputs = [np.concatenate(output) for output in zip(*outputs)]
+            preds = post_processing_batch(outputs)
+        else:
+            preds = head_predictions(np.concatenate(outputs), self.labels, self.variables)
+
+        return float(average_precision(preds, self.labels, self.threshold))
+
+    def _work(self, model: keras.Model):
+        try:
+            for epoch, weights in iter(self.snapshots.get, _DONE):
+                model.set_weights(weights)
+                ap = self.score(model)
+
+                improved = ap > self.best
+                if improved and self.filepath is not None:
+                    model.save(self.filepath)
+
+                with self.lock:
+                    self.scores[epoch] = ap
+                    if improved:
+                        self.best, self.best_epoch, self.best_weights = ap, epoch, weights
+                        self.wait = 0
+                    else:
+                        self.wait += 1
+                        if self.patience is not None and self.wait >= self.patience:
+                            self.stopped_epoch = epoch
+
+                print(f"\nEpoch {epoch + 1}: AP@{self.threshold} {ap:.4f} (best {self.best:.4f})")
+        except Exception as e:
+            with self.lock:
+                self.error = e
@@ -0,0 +1,299 @@
+"""
+Structured pruning of the head models.  Conv filters and dense units with the smallest L1 norm are
+removed physically, i.e. the pruned model is rebuilt with fewer channels, and the model is
+fine-tuned between pruning rounds.
+"""
+import tempfile
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+from tensorflow import keras
+from tensorflow.keras.layers import BatchNormalization
+from tensorflow.keras.layers import Conv2D
+from tensorflow.keras.layers import Dense
+from tensorflow.keras.layers import Flatten
+from tensorflow.keras.layers import Input
+from tensorflow.keras.layers import InputLayer
+from tensorflow.keras.models import Model
+
+from src.helpers import make_data_batch
+from src.helpers import sample_rng
+from src.main import average_precision
+from src.main import head_predictions
+from src.main import predict
+from src.model_cache import clone_model
+from src.model_cache import load_cached_model
+from src.train import HEADS
+from src.train import RECIPES
+from src.train import stack_models
+
+
+def _chain(model: Model) -> List[keras.layers.Layer]:
+    """Layers of a single-input, single-output model in execution order."""
+    return [layer for layer in model.layers if not isinstance(layer, InputLayer)]
+
+
+def _importance(layer: keras.layers.Layer) -> np.ndarray:
+    """L1 norm of every conv filter or dense unit."""
+    kernel = layer.get_weights()[0]
+    return np.abs(kernel).reshape(-1, kernel.shape[-1]).sum(axis=0)
+
+
+def prune_model(model: Model, ratio: float) -> Model:
+    """Removes the least important conv filters and dense units of a chain model.
+
+    Every Conv2D and Dense layer except the output layer loses `ratio` of its filters/units.  The
+    matching BatchNormalization parameters and the input channels of the following layer are removed
+    with them, so the returned model is physically smaller.
+
+    Args:
+        model (Model): Model to prune, e.g. one of the `gen_*` heads.
+        ratio (float): Fraction of the filters/units to remove from each layer.
+
+    Returns:
+        Model: Pruned copy of the model.
+    """
+
+    layers = _chain(model)
+    weighted = [ii for ii, layer in enumerate(layers) if isinstance(layer, (Conv2D, Dense))]
+
+    inputs = Input(shape=model.input_shape[1:])
+    x = inputs
+    keep = None  # channels of the current activation that survive, None keeps all
+    new_weights = []
+
+    for ii, layer in enumerate(layers):
+        config = layer.get_config()
+        weights = layer.get_weights()
+
+        if isinstance(layer, (Conv2D, Dense)):
+            kernel, bias = weights
+            if keep is not None:
+                kernel = kernel[..., keep, :]
+
+            keep = None
+            if ii != weighted[-1]:
+                n_keep = max(1, int(round(kernel.shape[-1] * (1 - ratio))))
+                keep = np.sort(np.argsort(_importance(layer))[::-1][:n_keep])
+                kernel = kernel[..., keep]
+                bias = bias[keep]
+                config["filters" if isinstance(layer, Conv2D) else "units"] = n_keep
+
+            weights = [kernel, bias]
+
+        elif isinstance(layer, BatchNormalization):
+            if keep is not None:
+                weights = [w[keep] for w in weights]
+
+        elif isinstance(layer, Flatten):
+            if keep is not None:
+                # flattened index of channel c at spatial position p is p * channels + c
+                shape = layer.get_input_shape_at(0)
+                positions = np.prod(shape[1:-1], dtype=int)
+                keep = (np.arange(positions)[:, None] * shape[-1] + keep).ravel()
+
+        new_layer = layer.__class__.from_config(config)
+        x = new_layer(x)
+        new_weights.append((new_layer, weights))
+
+    for new_layer, weights in new_weights:
+        new_layer.set_weights(weights)
+
+    return Model(inputs=inputs, outputs=x)
+
+
+def fine_tune(
+    model: Model, head: str, steps_per_epoch: int = 50, epochs: int = 2, **kwargs
+) -> Model:
+    """Fine-tunes a (pruned) head with its training recipe.
+
+    Args:
+        model (Model): Head model.
+        head (str): Name of the head, a key of `RECIPES`.
+        steps_per_epoch (int, optional): Number of training steps per epoch. Defaults to 50.
+        epochs (int, optional): Number of epochs to train. Defaults to 2.
+        **kwargs: Passed through to the `train_*_model` recipe.
+
+    Returns:
+        Model: The fine-tuned model.
+    """
+
+    train = RECIPES[head][0]
+
+    # the loss checkpoint goes to a scratch directory, the trained head is returned
+    with tempfile.TemporaryDirectory() as model_path:
+        train(
+            steps_per_epoch=steps_per_epoch,
+            epochs=epochs,
+            model_path=model_path,
+            model=model,
+            **kwargs,
+        )
+
+    return model
+
+
+def prune_head(
+    model: Model,
+    head: str,
+    ratio: float = 0.5,
+    rounds: int = 3,
+    steps_per_epoch: int = 50,
+    epochs: int = 2,
+    **kwargs,
+) -> Model:
+    """Gradually prunes a head, fine-tuning after every round.
+
+    Args:
+        model (Model): Head model.
+        head (str): Name of the head, a key of `RECIPES`.
+        ratio (float, optional): Total fraction of the filters/units to remove. Defaults to 0.5.
+        rounds (int, optional): Number of prune and fine-tune rounds. Defaults to 3.
+        steps_per_epoch (int, optional): Fine-tuning steps per epoch. Defaults to 50.
+        epochs (int, optional): Fine-tuning epochs per round. Defaults to 2.
+        **kwargs: Passed through to the `train_*_model` recipe.
+
+    Returns:
+        Model: The pruned and fine-tuned model.
+    """
+
+    round_ratio = 1 - (1 - ratio) ** (1 / rounds)
+
+    for _ in range(rounds):
+        model = prune_model(model, round_ratio)
+        model = fine_tune(model, head, steps_per_epoch=steps_per_epoch, epochs=epochs, **kwargs)
+
+    return model
+
+
+def count_params(model: Model) -> int:
+    """Number of trainable parameters."""
+    return int(sum(np.prod(w.shape) for w in model.trainable_weights))
+
+
+def count_flops(model: Model) -> int:
+    """Multiply-accumulate FLOPs (2 per MAC) of the Conv2D and Dense layers for a single image."""
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, Conv2D):
+            _, height, width, _ = layer.get_output_shape_at(0)
+            flops += 2 * height * width * np.prod(layer.kernel.shape)
+        elif isinstance(layer, Dense):
+            flops += 2 * np.prod(layer.kernel.shape)
+
+    return int(flops)
+
+
+def measure_latency(model: Model, batch_size: int = 1, runs: int = 20) -> float:
+    """Median time in seconds per image of a forward pass, after a warmup call."""
+    x = np.zeros((batch_size, *model.input_shape[1:]), dtype=np.float32)
+    model(x, training=False)
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model(x, training=False)
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times)) / batch_size
+
+
+def head_ap(model: Model, head: str, imgs: np.ndarray, labels: np.ndarray) -> float:
+    """AP@0.7 of a single head, with the parameters it does not predict taken from the labels.
+
+    Args:
+        model (Model): Head model.
+        head (str): Name of the head, a key of `RECIPES`.
+        imgs (np.ndarray): Evaluation images.
+        labels (np.ndarray): Evaluation labels.
+
+    Returns:
+        float: AP of the head on its own.
+    """
+    outputs = model.predict(2 * imgs - 1, batch_size=64, verbose=0)
+    return average_precision(head_predictions(outputs, labels, RECIPES[head][2]), labels)
+
+
+def report(models: Dict[str, Model], imgs: np.ndarray, labels: np.ndarray) -> Dict[str, dict]:
+    """Params, FLOPs, latency and AP@0.7 of every head and of the combined model.
+
+    The AP of a head is its own AP, see `head_ap`, and the AP of the combined model is the AP of
+    the heads stacked together.
+
+    Args:
+        models (Dict[str, Model]): Head models, keyed like `HEADS`.
+        imgs (np.ndarray): Evaluation images.
+        labels (np.ndarray): Evaluation labels.
+
+    Returns:
+        Dict[str, dict]: Metrics keyed by head name and "combined".
+    """
+
+    metrics = {}
+    for name in HEADS:
+        metrics[name] = {
+            "params": count_params(models[name]),
+            "flops": count_flops(models[name]),
+            "latency": measure_latency(models[name]),
+            "ap": head_ap(models[name], name, imgs, labels),
+        }
+
+    # stacking renames the layers of the heads, so it gets fresh clones on every call
+    combined = stack_models([clone_model(models[name]) for name in HEADS])
+    metrics["combined"] = {
+        "params": sum(m["params"] for m in metrics.values()),
+        "flops": sum(m["flops"] for m in metrics.values()),
+        "latency": measure_latency(combined),
+        "ap": average_precision(predict(combined, imgs), labels),
+    }
+
+    return metrics
+
+
+def main(
+    ratio: float = 0.5,
+    rounds: int = 3,
+    no_samples: int = 1000,
+    seed: int = 0,
+    save_path: Optional[str] = "save/pruned_model_",
+):
+    """Prunes every head and prints their metrics before and after.
+
+    Args:
+        ratio (float, optional): Total fraction of the filters/units to remove. Defaults to 0.5.
+        rounds (int, optional): Number of prune and fine-tune rounds. Defaults to 3.
+        no_samples (int, optional): Number of evaluation samples. Defaults to 1000.
+        seed (int, optional): Seed of the evaluation samples. Defaults to 0.
+        save_path (str, optional): Prefix of the saved pruned heads. Defaults to "save/pruned_model_".
+    """
+
+    imgs, labels = make_data_batch(no_samples, rng=sample_rng(seed), dtype=np.float32)
+
+    original = {name: load_cached_model(RECIPES[name][1]) for name in HEADS}
+    before = report(original, imgs, labels)
+
+    pruned = {}
+    for name in HEADS:
+        pruned[name] = prune_head(original[name], name, ratio, rounds)
+        if save_path is not None:
+            pruned[name].save(save_path + name)
+
+    after = report(pruned, imgs, labels)
+
+    print(f"{'model':<10} {'params':>17} {'MFLOPs':>17} {'latency (ms)':>17} {'AP@0.7':>13}")
+    for name in before:
+        b, a = before[name], after[name]
+        print(
+            f"{name:<10} "
+            f"{b['params']:>8} {a['params']:>8} "
+            f"{b['flops'] / 1e6:>8.1f} {a['flops'] / 1e6:>8.1f} "
+            f"{b['latency'] * 1e3:>8.2f} {a['latency'] * 1e3:>8.2f} "
+            f"{b['ap']:>6.3f} {a['ap']:>6.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
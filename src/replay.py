@@ -0,0 +1,192 @@
+import threading
+from collections import deque
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """Bounded in-memory buffer of generated samples, replayed by their most recent loss.
+
+    Samples live in preallocated ring arrays that are allocated on the first insertion.  Every
+    batch mixes `fresh_fraction` newly generated samples with samples replayed with probability
+    proportional to `(loss + eps) ** alpha`, so hard examples are seen more often.  When the buffer
+    is full, fresh samples overwrite either the oldest (`eviction="age"`) or the lowest priority
+    (`eviction="priority"`) slots.
+
+    Batches handed out by `make_batch` are queued until their losses are reported with `update`, in
+    the same order.  This matches the order in which Keras consumes a prefetched generator.  Keras
+    builds batches on its generator thread and reports losses on the training thread, so every
+    public method holds a lock.
+
+    Args:
+        capacity (int, optional): Maximum number of stored samples. Defaults to 2048.
+        fresh_fraction (float, optional): Fraction of every batch that is freshly generated. Defaults to 0.25.
+        eviction (str, optional): Either "age" or "priority". Defaults to "age".
+        alpha (float, optional): Prioritization exponent, 0 samples uniformly. Defaults to 1.0.
+        eps (float, optional): Added to every priority so no sample is starved. Defaults to 1e-3.
+        rng (np.random.Generator, optional): Random generator used for replay. Defaults to None (unseeded).
+    """
+
+    def __init__(
+        self,
+        capacity: int = 2048,
+        fresh_fraction: float = 0.25,
+        eviction: str = "age",
+        alpha: float = 1.0,
+        eps: float = 1e-3,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        if eviction not in ("age", "priority"):
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        if not 0 < fresh_fraction <= 1:
+            raise ValueError("fresh_fraction must be in (0, 1]")
+
+        self.capacity = capacity
+        self.fresh_fraction = fresh_fraction
+        self.eviction = eviction
+        self.alpha = alpha
+        self.eps = eps
+        self.rng = np.random.default_rng() if rng is None else rng
+
+        self.imgs = None
+        self.labels = None
+        self.priority = np.zeros(capacity)
+        self.uid = np.full(capacity, -1, dtype=np.int64)  # identifies the sample held by a slot
+        self.size = 0
+        self.head = 0
+        self.next_uid = 0
+        self.pending = deque()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _allocate(self, imgs: np.ndarray, labels: np.ndarray):
+        self.imgs = np.empty((self.capacity, *imgs.shape[1:]), dtype=imgs.dtype)
+        self.labels = np.empty((self.capacity, *labels.shape[1:]), dtype=labels.dtype)
+
+    def _free_slots(self, n: int) -> np.ndarray:
+        """Slots that new samples are written to, evicting old samples once the buffer is full."""
+        empty = np.arange(self.size, min(self.size + n, self.capacity))
+        n_evict = n - empty.size
+
+        if n_evict == 0:
+            evicted = empty[:0]
+        elif self.eviction == "age":
+            evicted = (self.head + np.arange(n_evict)) % self.capacity
+            self.head = (self.head + n_evict) % self.capacity
+        else:
+            evicted = np.argpartition(self.priority, n_evict - 1)[:n_evict]
+
+        return np.concatenate([empty, evicted])
+
+    def add(
+        self, imgs: np.ndarray, labels: np.ndarray, priority: Optional[float] = None
+    ) -> np.ndarray:
+        """Stores samples in the buffer.
+
+        Args:
+            imgs (np.ndarray): Images to store.
+            labels (np.ndarray): Matching labels.
+            priority (float, optional): Initial priority. Defaults to None (current maximum priority).
+
+        Returns:
+            np.ndarray: Slots the samples were written to.
+        """
+        with self.lock:
+            return self._add(imgs, labels, priority)
+
+    def _add(
+        self, imgs: np.ndarray, labels: np.ndarray, priority: Optional[float] = None
+    ) -> np.ndarray:
+        if len(imgs) > self.capacity:
+            raise ValueError("Cannot add more samples than the buffer capacity")
+        if self.imgs is None:
+            self._allocate(imgs, labels)
+
+        if priority is None:
+            priority = self.priority[: self.size].max(initial=0.0)
+
+        slots = self._free_slots(len(imgs))
+        self.imgs[slots] = imgs
+        self.labels[slots] = labels
+        self.priority[slots] = priority
+        self.uid[slots] = self.next_uid + np.arange(slots.size)
+        self.next_uid += slots.size
+        self.size = min(self.size + slots.size, self.capacity)
+
+        return slots
+
+    def sample(self, n: int, exclude: Optional[np.ndarray] = None) -> np.ndarray:
+        """Draws distinct slots with probability proportional to their priority.
+
+        Args:
+            n (int): Number of slots.
+            exclude (np.ndarray, optional): Slots that must not be drawn. Defaults to None.
+
+        Returns:
+            np.ndarray: Sampled slots.
+        """
+        with self.lock:
+            return self._sample(n, exclude)
+
+    def _sample(self, n: int, exclude: Optional[np.ndarray] = None) -> np.ndarray:
+        if n == 0:
+            return np.zeros(0, dtype=int)
+
+        p = (self.priority[: self.size] + self.eps) ** self.alpha
+        if exclude is not None:
+            p[exclude] = 0
+
+        return self.rng.choice(self.size, size=n, replace=False, p=p / p.sum())
+
+    def make_batch(
+        self, generate: Callable[[int], Tuple[np.ndarray, np.ndarray]], batch_size: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Builds a training batch from fresh and replayed samples.
+
+        The batch is all fresh until the buffer holds enough samples to replay from.
+
+        Args:
+            generate (Callable): Returns `n` fresh (images, labels), e.g. a wrapped `make_batch`.
+            batch_size (int): Batch shape.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The image array and the labels.
+        """
+        n_fresh = int(np.ceil(self.fresh_fraction * batch_size))
+        if len(self) < batch_size:
+            n_fresh = batch_size
+
+        # generated outside the lock, so `update` is not held up by the generator
+        imgs, labels = generate(n_fresh)
+
+        with self.lock:
+            fresh_slots = self._add(imgs, labels)
+            replay_slots = self._sample(batch_size - n_fresh, exclude=fresh_slots)
+            slots = np.concatenate([fresh_slots, replay_slots])
+
+            self.pending.append((slots, self.uid[slots]))
+
+            return self.imgs[slots], self.labels[slots]
+
+    def update(self, losses: np.ndarray):
+        """Sets the priorities of the oldest batch handed out by `make_batch` to its losses.
+
+        Slots that were overwritten since the batch was built are left untouched.
+
+        Args:
+            losses (np.ndarray): Per-sample losses of the batch.
+        """
+        with self.lock:
+            slots, uid = self.pending.popleft()
+            alive = self.uid[slots] == uid
+            self.priority[slots[alive]] = np.asarray(losses)[alive]
+
+    def clear_pending(self):
+        """Drops the batches whose losses will never be reported, e.g. prefetched at the end of training."""
+        with self.lock:
+            self.pending.clear()
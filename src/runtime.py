@@ -0,0 +1,338 @@
+"""
+CPU runtime configuration.  Sets the TensorFlow thread pools, pins the model and the data generation
+workers to separate cores, and runs model replicas in separate processes pinned to NUMA-local core
+sets.
+"""
+import glob
+import multiprocessing as mp
+import os
+import queue
+import time
+from dataclasses import dataclass
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+# streams of the data workers start here, clear of the streams drawn in the training process
+WORKER_STREAM = 1 << 16
+
+
+@dataclass
+class RuntimeConfig:
+    """Threading and core pinning of a process.
+
+    Args:
+        intra_op_threads (int, optional): TensorFlow threads used inside an op, 0 lets TensorFlow decide. Defaults to 0.
+        inter_op_threads (int, optional): TensorFlow ops run concurrently, 0 lets TensorFlow decide. Defaults to 0.
+        model_cores (List[int], optional): Cores of the process running the model. Defaults to None (unpinned).
+        data_cores (List[int], optional): Cores of the data generation workers. Defaults to None (unpinned).
+        data_workers (int, optional): Number of data generation processes, 0 generates in the training process. Defaults to 0.
+    """
+
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    model_cores: Optional[List[int]] = None
+    data_cores: Optional[List[int]] = None
+    data_workers: int = 0
+
+    @classmethod
+    def split(cls, data_fraction: float = 0.25) -> "RuntimeConfig":
+        """Splits the available cores between data generation and the model.
+
+        Data generation gets the last cores, so the model keeps the first NUMA nodes.
+
+        Args:
+            data_fraction (float, optional): Fraction of the cores used for data generation. Defaults to 0.25.
+
+        Returns:
+            RuntimeConfig: Configuration with one data worker per data core.
+        """
+        cores = available_cores()
+        n_data = min(len(cores) - 1, int(round(len(cores) * data_fraction)))
+        model_cores = cores[: len(cores) - n_data]
+        data_cores = cores[len(cores) - n_data :]
+
+        return cls(
+            intra_op_threads=len(model_cores),
+            inter_op_threads=2,
+            model_cores=model_cores,
+            data_cores=data_cores or None,
+            data_workers=len(data_cores),
+        )
+
+
+def _parse_cpulist(cpulist: str) -> List[int]:
+    """Parses a Linux cpulist such as "0-3,8-11"."""
+    cores = []
+    for part in cpulist.strip().split(","):
+        if "-" in part:
+            start, stop = part.split("-")
+            cores.extend(range(int(start), int(stop) + 1))
+        elif part:
+            cores.append(int(part))
+    return cores
+
+
+def available_cores() -> List[int]:
+    """Cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def numa_nodes() -> List[List[int]]:
+    """Available cores grouped by NUMA node.  A single node is returned when the topology is unknown."""
+    available = set(available_cores())
+
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        with open(path) as f:
+            cores = [c for c in _parse_cpulist(f.read()) if c in available]
+        if cores:
+            nodes.append(cores)
+
+    return nodes or [sorted(available)]
+
+
+def core_sets(replicas: int, cores: Optional[List[int]] = None) -> List[List[int]]:
+    """Splits cores into one contiguous set per replica.
+
+    Cores are ordered node by node, so sets do not straddle NUMA nodes when the number of replicas is a
+    multiple of the number of nodes.
+
+    Args:
+        replicas (int): Number of sets.
+        cores (List[int], optional): Cores to split. Defaults to None (all cores, in NUMA order).
+
+    Returns:
+        List[List[int]]: Core set of every replica.
+    """
+    if cores is None:
+        cores = [c for node in numa_nodes() for c in node]
+    if replicas > len(cores):
+        raise ValueError(f"Cannot split {len(cores)} cores between {replicas} replicas")
+
+    return [chunk.tolist() for chunk in np.array_split(np.asarray(cores), replicas)]
+
+
+def pin(cores: Optional[List[int]]):
+    """Pins the current process to cores.  Does nothing without cores or on platforms without affinity."""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+
+def configure(config: RuntimeConfig):
+    """Applies a runtime configuration to the current process.
+
+    TensorFlow fixes its thread pools when it first runs an op, so call this before building or
+    loading any model.
+
+    Args:
+        config (RuntimeConfig): Configuration to apply.
+    """
+    import tensorflow as tf
+
+    pin(config.model_cores)
+    tf.config.threading.set_intra_op_parallelism_threads(config.intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(config.inter_op_threads)
+
+
+def _init_data_worker(cores: Optional[List[int]]):
+    pin(cores)
+
+
+def _make_batch_worker(args: tuple) -> Tuple[np.ndarray, np.ndarray]:
+    from src.helpers import sample_rng
+    from src.train import make_batch
+
+    batch_kwargs, seed, stream, index = args
+    rng = None if seed is None else sample_rng(seed, stream, index)
+    return make_batch(rng=rng, **batch_kwargs)
+
+
+class DataWorkers:
+    """Pool of data generation processes pinned to the data cores.
+
+    Calling the pool generates a batch split evenly between the workers.  With a seed, the chunk of
+    worker `j` in call `k` is drawn with `sample_rng(seed, WORKER_STREAM + j, k)`.
+
+    Args:
+        config (RuntimeConfig): Runtime configuration, uses `data_workers` and `data_cores`.
+        seed (int, optional): Root seed. Defaults to None (unseeded).
+        **batch_kwargs: Passed through to `make_batch`.
+    """
+
+    def __init__(self, config: RuntimeConfig, seed: Optional[int] = None, **batch_kwargs):
+        self.workers = max(1, config.data_workers)
+        self.seed = seed
+        self.batch_kwargs = batch_kwargs
+        self.calls = 0
+
+        ctx = mp.get_context("spawn")
+        self.pool = ctx.Pool(self.workers, _init_data_worker, (config.data_cores,))
+
+    def __call__(self, batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        sizes = [len(chunk) for chunk in np.array_split(np.arange(batch_size), self.workers)]
+        tasks = [
+            ({**self.batch_kwargs, "batch_size": size}, self.seed, WORKER_STREAM + j, self.calls)
+            for j, size in enumerate(sizes)
+            if size > 0
+        ]
+        self.calls += 1
+
+        imgs, labels = zip(*self.pool.map(_make_batch_worker, tasks))
+
+        return np.concatenate(imgs), np.concatenate(labels)
+
+    def close(self):
+        self.pool.terminate()
+
+    def __enter__(self) -> "DataWorkers":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _replica_worker(model_path: str, cores: List[int], tasks: mp.Queue, results: mp.Queue):
+    configure(RuntimeConfig(intra_op_threads=len(cores), inter_op_threads=1, model_cores=cores))
+
+    from tensorflow import keras
+
+    from src.main import predict
+
+    model = keras.models.load_model(model_path)
+    predict(model, np.zeros((1, 200, 200), dtype=np.float32))  # warmup
+    results.put(None)  # ready
+
+    for task in iter(tasks.get, None):
+        index, imgs = task
+        results.put((index, predict(model, imgs, batch_size=len(imgs))))
+
+
+class ReplicaPool:
+    """Model replicas running in separate processes, each pinned to its own core set.
+
+    Args:
+        model_path (str, optional): Path of the combined model. Defaults to "save/best_combined_model".
+        replicas (int, optional): Number of replicas. Defaults to 1.
+        cores (List[int], optional): Cores split between the replicas. Defaults to None (all cores).
+        timeout (float, optional): Seconds between checks that the replicas are still alive. Defaults to 1.
+
+    Raises:
+        RuntimeError: A replica died, e.g. on a missing model or out of memory.
+    """
+
+    def __init__(
+        self,
+        model_path: str = "save/best_combined_model",
+        replicas: int = 1,
+        cores: Optional[List[int]] = None,
+        timeout: float = 1.0,
+    ):
+        self.timeout = timeout
+        ctx = mp.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.workers = [
+            ctx.Process(
+                target=_replica_worker,
+                args=(model_path, core_set, self.tasks, self.results),
+                daemon=True,
+            )
+            for core_set in core_sets(replicas, cores)
+        ]
+
+        for worker in self.workers:
+            worker.start()
+        for _ in self.workers:
+            self._get()
+
+    def _get(self):
+        """Next result, raises instead of waiting forever once a replica has died."""
+        while True:
+            try:
+                return self.results.get(timeout=self.timeout)
+            except queue.Empty:
+                pass
+
+            dead = [worker for worker in self.workers if not worker.is_alive()]
+            if dead:
+                for worker in self.workers:
+                    worker.terminate()
+                codes = ", ".join(str(worker.exitcode) for worker in dead)
+                raise RuntimeError(f"{len(dead)} replica(s) died with exit code {codes}")
+
+    def predict(self, imgs: np.ndarray, batch_size: int = 16) -> np.ndarray:
+        """Spreads batches of images over the replicas.
+
+        Args:
+            imgs (np.ndarray): (N, 200, 200) raw images.
+            batch_size (int, optional): Images per task. Defaults to 16.
+
+        Returns:
+            np.ndarray: (N, 5) predicted parameters, in input order.
+        """
+        starts = range(0, len(imgs), batch_size)
+        for index, start in enumerate(starts):
+            self.tasks.put((index, imgs[start : start + batch_size]))
+
+        preds = dict(self._get() for _ in starts)
+
+        return np.concatenate([preds[index] for index in range(len(starts))])
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def __enter__(self) -> "ReplicaPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def benchmark(
+    model_path: str = "save/best_combined_model",
+    replicas: Tuple[int, ...] = (1,),
+    no_images: int = 256,
+    batch_size: int = 16,
+):
+    """Prints images/sec of the combined model from 1 core up to all cores.
+
+    Args:
+        model_path (str, optional): Path of the combined model. Defaults to "save/best_combined_model".
+        replicas (Tuple[int, ...], optional): Replica counts to try for every core count. Defaults to (1,).
+        no_images (int, optional): Images predicted per measurement. Defaults to 256.
+        batch_size (int, optional): Images per task. Defaults to 16.
+    """
+    from src.helpers import make_data_batch
+
+    cores = [c for node in numa_nodes() for c in node]
+    counts = sorted(
+        {2**i for i in range(len(cores).bit_length()) if 2**i < len(cores)} | {len(cores)}
+    )
+    imgs, _ = make_data_batch(no_images, dtype=np.float32)
+
+    print(f"{'cores':>6} {'replicas':>9} {'images/sec':>11}")
+    for count in counts:
+        for k in replicas:
+            if k > count:
+                continue
+
+            with ReplicaPool(model_path, replicas=k, cores=cores[:count]) as pool:
+                pool.predict(imgs[: batch_size * k], batch_size=batch_size)  # warmup
+
+                start = time.perf_counter()
+                pool.predict(imgs, batch_size=batch_size)
+                elapsed = time.perf_counter() - start
+
+            print(f"{count:>6} {k:>9} {no_images / elapsed:>11.1f}")
+
+
+if __name__ == "__main__":
+    benchmark(replicas=(1, 2, 4))
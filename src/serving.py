@@ -0,0 +1,131 @@
+"""
+Serving export of the combined model.  Input normalization and the full `post_processing` math are
+baked into a traced `tf.function` signature, so serving skips the Keras `predict` bookkeeping and
+returns the (N, 5) parameter array directly from raw images.
+"""
+from typing import Optional
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from src.model_cache import load_cached_model
+from src.runtime import configure
+from src.runtime import RuntimeConfig
+
+IMAGE_SIZE = 200
+
+
+def _normalization(
+    min_x: float, max_x: float, inputs: tf.Tensor, tgt_min: float, tgt_max: float
+) -> tf.Tensor:
+    """TensorFlow version of `src.train.normalization`."""
+    val = (tgt_max - tgt_min) * (inputs - min_x) / (max_x - min_x) + tgt_min
+    return tf.clip_by_value(val, tgt_min, tgt_max)
+
+
+class ServingModule(tf.Module):
+    """Wraps the combined model with pre- and post-processing.
+
+    Args:
+        model (keras.Model): Combined model.
+    """
+
+    def __init__(self, model: keras.Model):
+        super().__init__()
+        self.model = model
+
+    @tf.function(
+        input_signature=[tf.TensorSpec([None, IMAGE_SIZE, IMAGE_SIZE], tf.float32, name="images")]
+    )
+    def serve(self, images: tf.Tensor) -> dict:
+        """Predicts the spaceship parameters of a batch of raw images.
+
+        Args:
+            images (tf.Tensor): (N, 200, 200) images as produced by `make_data`.
+
+        Returns:
+            dict: "params", the (N, 5) x, y, yaw, width and height.  Rows are NaN when no spaceship is detected.
+        """
+
+        # perform pre-processing
+        inputs = 2 * images[..., None] - 1
+
+        detection, position, angle, area = self.model(inputs, training=False)
+
+        # fmt: off
+        x       = _normalization(min_x=-1, max_x=1, inputs=position[:, 0], tgt_min=10,  tgt_max=190)
+        y       = _normalization(min_x=-1, max_x=1, inputs=position[:, 1], tgt_min=10,  tgt_max=190)
+        sin     = _normalization(min_x=-1, max_x=1, inputs=angle[:, 0],    tgt_min=-1,  tgt_max=1)
+        cos     = _normalization(min_x=-1, max_x=1, inputs=angle[:, 1],    tgt_min=-1,  tgt_max=1)
+        width   = _normalization(min_x=-1, max_x=1, inputs=area[:, 0],     tgt_min=18,  tgt_max=36)
+        height  = _normalization(min_x=-1, max_x=1, inputs=area[:, 1],     tgt_min=18,  tgt_max=75)
+        # fmt: on
+
+        # calculate yaw
+        yaw = tf.math.atan2(sin, cos)
+        yaw = tf.where(yaw < 0, yaw + 2 * np.pi, yaw)
+
+        params = tf.stack([x, y, yaw, width, height], axis=1)
+
+        # return nan if no object in image
+        nan = tf.fill(tf.shape(params), float("nan"))
+        params = tf.where(detection[:, :1] <= 0, nan, params)
+
+        return {"params": params}
+
+
+def export_serving_model(
+    model_path: str = "save/best_combined_model", export_path: str = "save/serving_model"
+):
+    """Exports the combined model as a SavedModel with a single serving signature.
+
+    Args:
+        model_path (str, optional): Path of the combined model. Defaults to "save/best_combined_model".
+        export_path (str, optional): Path of the exported SavedModel. Defaults to "save/serving_model".
+    """
+
+    module = ServingModule(load_cached_model(model_path))
+    tf.saved_model.save(module, export_path, signatures={"serving_default": module.serve})
+
+
+class ServingModel:
+    """Loads an exported serving signature and warms it up, so the first request runs as fast as the
+    steady state.
+
+    Args:
+        export_path (str, optional): Path of the exported SavedModel. Defaults to "save/serving_model".
+        warmup_batch_sizes (tuple, optional): Batch sizes run once with dummy images. Defaults to (1, 64).
+        runtime (RuntimeConfig, optional): Threading and core pinning. Defaults to None (TensorFlow defaults).
+    """
+
+    def __init__(
+        self,
+        export_path: str = "save/serving_model",
+        warmup_batch_sizes: tuple = (1, 64),
+        runtime: Optional[RuntimeConfig] = None,
+    ):
+        if runtime is not None:
+            configure(runtime)
+
+        self.loaded = tf.saved_model.load(export_path)
+        self.signature = self.loaded.signatures["serving_default"]
+
+        for batch_size in warmup_batch_sizes:
+            self(np.zeros((batch_size, IMAGE_SIZE, IMAGE_SIZE), dtype=np.float32))
+
+    def __call__(self, imgs: np.ndarray) -> np.ndarray:
+        """Predicts the spaceship parameters.
+
+        Args:
+            imgs (np.ndarray): (N, 200, 200) raw images.
+
+        Returns:
+            np.ndarray: (N, 5) predicted parameters, NaN where nothing was detected.
+        """
+        images = tf.convert_to_tensor(imgs, dtype=tf.float32)
+        return self.signature(images=images)["params"].numpy()
+
+
+if __name__ == "__main__":
+    export_serving_model()
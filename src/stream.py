@@ -0,0 +1,270 @@
+"""
+Streaming inference over sequences of frames.  Frames are preprocessed, batched, run through the
+model and post-processed on separate threads, so the stages overlap, and a batch is dispatched at
+the latest `max_delay` seconds after its oldest frame arrived, which bounds the latency per frame.
+"""
+import queue
+import threading
+import time
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
+import numpy as np
+from tensorflow import keras
+
+from src.helpers import make_data
+from src.helpers import make_data_stream
+from src.helpers import sample_rng
+from src.main import post_processing_batch
+from src.model_cache import load_cached_model
+
+_DONE = object()
+
+
+def frame_source(
+    n_frames: Optional[int] = None,
+    fps: Optional[float] = None,
+    repeat: float = 0.0,
+    seed: Optional[int] = None,
+    **kwargs,
+) -> Iterator[np.ndarray]:
+    """Stand-in for a camera, yields `make_data` images as frames.
+
+    Args:
+        n_frames (int, optional): Number of frames. Defaults to None (endless).
+        fps (float, optional): Frame rate, frames are held back until they are due. Defaults to None (as fast as possible).
+        repeat (float, optional): Probability that a frame repeats the previous one unchanged. Defaults to 0.0.
+        seed (int, optional): Root seed of the frames. Defaults to None (unseeded).
+        **kwargs: Passed through to `make_data`.
+
+    Yields:
+        np.ndarray: (200, 200) frame.
+    """
+    if seed is None:
+        samples = iter(lambda: make_data(**kwargs), None)
+        rng = np.random.default_rng()
+    else:
+        samples = make_data_stream(seed, **kwargs)
+        rng = sample_rng(seed, stream=1)
+
+    start = time.perf_counter()
+    frame = None
+    index = 0
+    while n_frames is None or index < n_frames:
+        if frame is None or rng.uniform() >= repeat:
+            frame, _ = next(samples)
+
+        if fps is not None:
+            time.sleep(max(0.0, start + index / fps - time.perf_counter()))
+
+        yield frame
+        index += 1
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Blocking put that gives up once the consumer has stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """Blocking get that gives up once the consumer has stopped, returning None."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+class StreamingPredictor:
+    """Generator-in, generator-out inference of the combined model.
+
+    A reader thread timestamps and preprocesses the incoming frames, a model thread batches them and
+    runs the model, and the calling thread post-processes and yields the predictions in frame order.
+    With `reuse_tolerance`, a frame whose mean absolute difference to the last frame that was run
+    through the model is within the tolerance skips the model and gets the previous prediction.
+
+    Args:
+        model (keras.Model): Combined model.
+        max_batch (int, optional): Maximum frames per model call. Defaults to 16.
+        max_delay (float, optional): Seconds a frame may wait for its batch to fill. Defaults to 0.02.
+        reuse_tolerance (float, optional): Change below which a frame reuses the previous prediction. Defaults to None (every frame is run).
+        queue_size (int, optional): Frames buffered between the reader and the model. Defaults to 64.
+    """
+
+    def __init__(
+        self,
+        model: keras.Model,
+        max_batch: int = 16,
+        max_delay: float = 0.02,
+        reuse_tolerance: Optional[float] = None,
+        queue_size: int = 64,
+    ):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.reuse_tolerance = reuse_tolerance
+        self.queue_size = queue_size
+        self.latencies = []
+        self.reused = 0
+
+    def _read(self, frames: Iterator[np.ndarray], arrivals: queue.Queue, stop: threading.Event):
+        shape = (-1, *self.model.input_shape[1:])
+        key = None
+
+        try:
+            for frame in frames:
+                arrival = time.perf_counter()
+
+                inputs = None
+                if (
+                    key is None
+                    or self.reuse_tolerance is None
+                    or np.mean(np.abs(frame - key)) > self.reuse_tolerance
+                ):
+                    key = frame
+                    inputs = (2 * np.asarray(frame, dtype=np.float32) - 1).reshape(shape)
+
+                if not _put(arrivals, (arrival, inputs), stop):
+                    return
+            _put(arrivals, _DONE, stop)
+        except Exception as e:
+            _put(arrivals, e, stop)
+
+    def _infer(self, arrivals: queue.Queue, batches: queue.Queue, stop: threading.Event):
+        end = None
+        try:
+            while end is None:
+                item = _get(arrivals, stop)
+                if item is None:
+                    return
+                if item is _DONE or isinstance(item, Exception):
+                    end = item
+                    break
+
+                # fill the batch until it is full or its oldest frame is due
+                items = [item]
+                deadline = item[0] + self.max_delay
+                while len(items) < self.max_batch:
+                    timeout = deadline - time.perf_counter()
+                    try:
+                        item = (
+                            arrivals.get(timeout=timeout) if timeout > 0 else arrivals.get_nowait()
+                        )
+                    except queue.Empty:
+                        break
+                    if item is _DONE or isinstance(item, Exception):
+                        end = item
+                        break
+                    items.append(item)
+
+                inputs = [x for _, x in items if x is not None]
+                outputs = []
+                if inputs:
+                    outputs = self.model(np.concatenate(inputs), training=False)
+                    outputs = [np.asarray(o) for o in outputs]
+
+                if not _put(batches, (items, outputs), stop):
+                    return
+        except Exception as e:
+            end = e
+
+        _put(batches, end, stop)
+
+    def __call__(self, frames: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """Predicts the spaceship parameters of every frame.
+
+        Args:
+            frames (Iterable[np.ndarray]): (200, 200) raw frames, e.g. from `frame_source`.
+
+        Yields:
+            np.ndarray: (5,) predicted parameters of every frame, NaN where nothing was detected.
+        """
+        arrivals = queue.Queue(self.queue_size)
+        batches = queue.Queue(2)
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self._read, args=(iter(frames), arrivals, stop), daemon=True),
+            threading.Thread(target=self._infer, args=(arrivals, batches, stop), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            last = None
+            for item in iter(batches.get, _DONE):
+                if isinstance(item, Exception):
+                    raise item
+
+                items, outputs = item
+                preds = iter(post_processing_batch(outputs)) if outputs else iter(())
+                for arrival, inputs in items:
+                    if inputs is None:
+                        self.reused += 1
+                    else:
+                        last = next(preds)
+
+                    self.latencies.append(time.perf_counter() - arrival)
+                    yield last.copy()
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+
+def benchmark(
+    model_path: str = "save/best_combined_model",
+    n_frames: int = 500,
+    fps: Optional[float] = None,
+    repeat: float = 0.0,
+    max_batch: int = 16,
+    max_delay: float = 0.02,
+    reuse_tolerance: Optional[float] = None,
+):
+    """Prints the throughput and per-frame latency of streaming inference next to frame-by-frame
+    inference.
+
+    Args:
+        model_path (str, optional): Path of the combined model. Defaults to "save/best_combined_model".
+        n_frames (int, optional): Number of frames. Defaults to 500.
+        fps (float, optional): Frame rate of the source. Defaults to None (as fast as possible).
+        repeat (float, optional): Probability that a frame repeats the previous one. Defaults to 0.0.
+        max_batch (int, optional): Maximum frames per model call. Defaults to 16.
+        max_delay (float, optional): Seconds a frame may wait for its batch to fill. Defaults to 0.02.
+        reuse_tolerance (float, optional): Change below which a frame reuses the previous prediction. Defaults to None.
+    """
+    model = load_cached_model(model_path)
+    shape = (1, *model.input_shape[1:])
+    model(np.zeros(shape, dtype=np.float32), training=False)  # warmup
+
+    # frame by frame, as in `eval`
+    latencies = []
+    start = time.perf_counter()
+    for frame in frame_source(n_frames, fps=fps, repeat=repeat, seed=0):
+        arrival = time.perf_counter()
+        outputs = model((2 * frame.astype(np.float32) - 1).reshape(shape), training=False)
+        post_processing_batch([np.asarray(o) for o in outputs])
+        latencies.append(time.perf_counter() - arrival)
+    results = {"frame by frame": (time.perf_counter() - start, latencies, 0)}
+
+    predictor = StreamingPredictor(model, max_batch, max_delay, reuse_tolerance)
+    start = time.perf_counter()
+    for _ in predictor(frame_source(n_frames, fps=fps, repeat=repeat, seed=0)):
+        pass
+    results["streaming"] = (time.perf_counter() - start, predictor.latencies, predictor.reused)
+
+    print(f"{'':<15} {'frames/sec':>11} {'p50 (ms)':>9} {'p99 (ms)':>9} {'reused':>7}")
+    for name, (elapsed, latencies, reused) in results.items():
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+        print(f"{name:<15} {n_frames / elapsed:>11.1f} {p50:>9.2f} {p99:>9.2f} {reused:>7}")
+
+
+if __name__ == "__main__":
+    benchmark(repeat=0.2, reuse_tolerance=0.0)
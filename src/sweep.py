@@ -0,0 +1,301 @@
+"""
+Parallel hyperparameter sweeps over the `train_*_model` recipes.  Trials run concurrently in a process
+pool where every worker gets its own core set and TensorFlow thread budget, and trials that fall below
+the median held-out IOU of the other trials are stopped early.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from typing import Optional
+
+import numpy as np
+from tensorflow import keras
+
+from src.helpers import make_data_batch
+from src.helpers import sample_rng
+from src.helpers import score_iou
+from src.main import head_predictions
+from src.runtime import available_cores
+from src.runtime import configure
+from src.runtime import core_sets
+from src.runtime import RuntimeConfig
+from src.train import RECIPES
+
+
+def make_trials(space: dict, n_trials: Optional[int] = None, seed: int = 0) -> List[dict]:
+    """Expands a search space into trial parameters.
+
+    A list of values is searched over.  A (low, high) tuple is sampled log-uniformly, or uniformly for
+    integers, and is only allowed in random search.
+
+    Args:
+        space (dict): Values of every `train_*_model` argument, e.g. {"learning_rate": (1e-5, 1e-3), "batch_size": [64, 128]}.
+        n_trials (int, optional): Number of random trials. Defaults to None (full grid).
+        seed (int, optional): Seed of the random search. Defaults to 0.
+
+    Returns:
+        List[dict]: Arguments of every trial.
+    """
+    if n_trials is None:
+        if any(isinstance(values, tuple) for values in space.values()):
+            raise ValueError("Ranges are only supported in random search, pass n_trials")
+        return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+    rng = np.random.default_rng(seed)
+    trials = []
+    for _ in range(n_trials):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, list):
+                params[name] = values[rng.integers(len(values))]
+            elif all(isinstance(v, int) for v in values):
+                params[name] = int(rng.integers(values[0], values[1] + 1))
+            else:
+                params[name] = float(np.exp(rng.uniform(np.log(values[0]), np.log(values[1]))))
+        trials.append(params)
+
+    return trials
+
+
+def heldout_iou(
+    model: keras.Model, imgs: np.ndarray, labels: np.ndarray, variables: List[str]
+) -> float:
+    """Mean IOU of a single head, see `head_predictions`.
+
+    Args:
+        model (keras.Model): Head model.
+        imgs (np.ndarray): Raw held-out images.
+        labels (np.ndarray): Held-out labels.
+        variables (List[str]): Variables predicted by the head.
+
+    Returns:
+        float: Mean IOU, true negatives excluded.
+    """
+    preds = head_predictions(model.predict(2 * imgs - 1, verbose=0), labels, variables)
+
+    ious = [score_iou(pred, label) for pred, label in zip(preds, labels)]
+    ious = np.asarray(ious, dtype="float")
+
+    return float(np.nanmean(ious))
+
+
+def _init_worker(cores: mp.Queue, threads: Optional[int]):
+    core_set = cores.get()
+    configure(
+        RuntimeConfig(
+            intra_op_threads=threads or len(core_set), inter_op_threads=1, model_cores=core_set
+        )
+    )
+
+
+class MedianStopping(keras.callbacks.Callback):
+    """Custom Keras callback that scores the held-out IOU every epoch and stops the trial when it falls
+    below the median of the scores other trials reported at the same epoch.
+
+    Args:
+        imgs (np.ndarray): Raw held-out images.
+        labels (np.ndarray): Held-out labels.
+        variables (List[str]): Variables predicted by the head.
+        reports (dict): Shared mapping of epoch to the scores of all trials.
+        lock: Lock guarding `reports`.
+        grace_epochs (int, optional): Epochs before a trial can be stopped. Defaults to 2.
+        min_reports (int, optional): Scores of other trials required to stop. Defaults to 2.
+    """
+
+    def __init__(
+        self,
+        imgs: np.ndarray,
+        labels: np.ndarray,
+        variables: List[str],
+        reports: dict,
+        lock,
+        grace_epochs: int = 2,
+        min_reports: int = 2,
+    ):
+        super().__init__()
+        self.imgs = imgs
+        self.labels = labels
+        self.variables = variables
+        self.reports = reports
+        self.lock = lock
+        self.grace_epochs = grace_epochs
+        self.min_reports = min_reports
+        self.scores = []
+        self.pruned = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        score = heldout_iou(self.model, self.imgs, self.labels, self.variables)
+        self.scores.append(score)
+
+        with self.lock:
+            others = self.reports.get(epoch, [])
+            self.reports[epoch] = others + [score]
+
+        if epoch + 1 >= self.grace_epochs and len(others) >= self.min_reports:
+            if score < np.median(others):
+                self.pruned = True
+                self.model.stop_training = True
+
+
+def _run_trial(
+    recipe: str,
+    trial: int,
+    params: dict,
+    seed: int,
+    no_heldout: int,
+    save_dir: str,
+    reports: dict,
+    lock,
+    grace_epochs: int,
+    min_reports: int,
+) -> dict:
+    train, _, variables, has_spaceship = RECIPES[recipe]
+    keras.backend.clear_session()
+
+    # every trial scores the same held-out set
+    imgs, labels = make_data_batch(
+        no_heldout, has_spaceship=has_spaceship, rng=sample_rng(seed, stream=1), dtype=np.float32
+    )
+    stopping = MedianStopping(imgs, labels, variables, reports, lock, grace_epochs, min_reports)
+
+    start = time.perf_counter()
+    train(**params, model_path=f"{save_dir}/trial_{trial}", callbacks=[stopping], seed=seed)
+
+    return {
+        "trial": trial,
+        **params,
+        "iou": max(stopping.scores, default=float("nan")),
+        "epochs_run": len(stopping.scores),
+        "pruned": stopping.pruned,
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+
+
+def _sweep_dir(save_dir: str, recipe: str, config: dict) -> str:
+    """Empty directory of a sweep, keyed on the parameters that change its trials and results.
+
+    Args:
+        save_dir (str): Root directory of the sweeps.
+        recipe (str): Name of the recipe.
+        config (dict): Search space, seed and other parameters of the sweep.
+
+    Raises:
+        FileExistsError: A sweep with the same parameters already wrote to the directory.
+
+    Returns:
+        str: The directory, with the parameters written to "sweep.json".
+    """
+    key = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+    path = f"{save_dir}/{recipe}/{key}"
+    if os.path.isdir(path) and os.listdir(path):
+        raise FileExistsError(f"{path} holds a sweep with the same parameters, remove it to rerun")
+
+    os.makedirs(path, exist_ok=True)
+    with open(f"{path}/sweep.json", "w") as f:
+        json.dump(config, f, indent=2)
+
+    return path
+
+
+def sweep(
+    recipe: str,
+    space: dict,
+    n_trials: Optional[int] = None,
+    max_workers: int = 2,
+    threads_per_trial: Optional[int] = None,
+    seed: int = 0,
+    no_heldout: int = 200,
+    grace_epochs: int = 2,
+    min_reports: int = 2,
+    save_dir: str = "save/sweep",
+) -> List[dict]:
+    """Runs a hyperparameter sweep of a training recipe and writes a results table.
+
+    Args:
+        recipe (str): Name of the recipe, a key of `RECIPES`.
+        space (dict): Search space, see `make_trials`.
+        n_trials (int, optional): Number of random trials. Defaults to None (full grid).
+        max_workers (int, optional): Trials run concurrently, at most one per available core. Defaults to 2.
+        threads_per_trial (int, optional): TensorFlow threads of every trial. Defaults to None (size of its core set).
+        seed (int, optional): Seed of the search, the training data and the held-out set. Defaults to 0.
+        no_heldout (int, optional): Number of held-out samples. Defaults to 200.
+        grace_epochs (int, optional): Epochs before a trial can be stopped. Defaults to 2.
+        min_reports (int, optional): Scores of other trials required to stop a trial. Defaults to 2.
+        save_dir (str, optional): Root directory of the sweeps, every sweep writes its trial models and results to its own subdirectory, see `_sweep_dir`. Defaults to "save/sweep".
+
+    Returns:
+        List[dict]: Results of every trial, best held-out IOU first.
+    """
+    trials = make_trials(space, n_trials, seed)
+    max_workers = min(max_workers, len(available_cores()))
+    config = {
+        "space": space,
+        "n_trials": n_trials,
+        "seed": seed,
+        "no_heldout": no_heldout,
+        "grace_epochs": grace_epochs,
+        "min_reports": min_reports,
+    }
+    save_dir = _sweep_dir(save_dir, recipe, config)
+
+    ctx = mp.get_context("spawn")
+    manager = ctx.Manager()
+    reports = manager.dict()
+    lock = manager.Lock()
+    cores = manager.Queue()
+    for core_set in core_sets(max_workers):
+        cores.put(core_set)
+
+    with ProcessPoolExecutor(
+        max_workers, mp_context=ctx, initializer=_init_worker, initargs=(cores, threads_per_trial)
+    ) as pool:
+        futures = [
+            pool.submit(
+                _run_trial,
+                recipe,
+                trial,
+                params,
+                seed,
+                no_heldout,
+                save_dir,
+                reports,
+                lock,
+                grace_epochs,
+                min_reports,
+            )
+            for trial, params in enumerate(trials)
+        ]
+        results = [future.result() for future in futures]
+
+    manager.shutdown()
+    results.sort(key=lambda r: -r["iou"] if not np.isnan(r["iou"]) else np.inf)
+
+    with open(f"{save_dir}/results.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+    print(" | ".join(f"{name:>13}" for name in results[0]))
+    for result in results:
+        print(
+            " | ".join(
+                f"{value:>13.6g}" if isinstance(value, float) else f"{value!s:>13}"
+                for value in result.values()
+            )
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    sweep(
+        "position",
+        {"learning_rate": (1e-5, 1e-3), "batch_size": [64, 128], "epochs": [25, 50, 100]},
+        n_trials=8,
+    )
@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.fixture
+def make_model():
+    """Factory of small untrained models with the four outputs of the combined model."""
+    keras = pytest.importorskip("tensorflow").keras
+
+    def make(input_shape=(200, 200), activations=("tanh", "tanh", "tanh", "tanh")):
+        inputs = keras.Input(shape=input_shape)
+        x = keras.layers.Flatten()(inputs)
+        outputs = [
+            keras.layers.Dense(1, activation=activations[0], bias_initializer="ones")(x),
+            *(keras.layers.Dense(2, activation=activation)(x) for activation in activations[1:]),
+        ]
+        return keras.Model(inputs, outputs)
+
+    return make
+
+
+@pytest.fixture
+def make_head():
+    """Factory of small untrained single-head models, chains like the `gen_*` heads."""
+    keras = pytest.importorskip("tensorflow").keras
+
+    def make(units=2):
+        inputs = keras.Input(shape=(200, 200))
+        x = keras.layers.Reshape((200, 200, 1))(inputs)
+        x = keras.layers.Conv2D(2, 8, strides=8)(x)
+        x = keras.layers.Flatten()(x)
+        return keras.Model(inputs, keras.layers.Dense(units, activation="tanh")(x))
+
+    return make
+
+
+@pytest.fixture
+def save_model(make_model):
+    """Factory saving a model from `make_model` at a path and returning it."""
+
+    def save(path, **kwargs):
+        model = make_model(**kwargs)
+        model.save(path)
+        return model
+
+    return save
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from src.corpus import cached_outputs
+from src.corpus import load_corpus
+
+
+def test_corpus(tmp_path, save_model):
+    root = str(tmp_path / "corpus")
+    corpus = load_corpus("test", root=root, no_samples=8, seed=3)
+    loaded = load_corpus("test", root=root)
+
+    assert len(loaded) == 8
+    assert loaded.digest == corpus.digest
+    assert loaded.meta["seed"] == 3
+    np.testing.assert_array_equal(loaded.imgs, corpus.imgs)
+    np.testing.assert_array_equal(loaded.labels, corpus.labels)
+
+    model_path = str(tmp_path / "model")
+    model = save_model(model_path)
+    outputs = cached_outputs(model_path, loaded, root=root)
+    assert [o.shape for o in outputs] == [(8, 1), (8, 2), (8, 2), (8, 2)]
+
+    # predictions come from the cache until the model changes on disk
+    (entries,) = os.listdir(f"{root}/predictions")
+    assert len(os.listdir(f"{root}/predictions/{entries}")) == 1
+    np.testing.assert_array_equal(cached_outputs(model_path, loaded, root=root)[-1], outputs[-1])
+
+    model.layers[-1].set_weights([w + 1 for w in model.layers[-1].get_weights()])
+    model.save(model_path)
+    changed = cached_outputs(model_path, loaded, root=root)
+    assert len(os.listdir(f"{root}/predictions/{entries}")) == 2
+    assert not np.allclose(changed[-1], outputs[-1])
+
+
+def test_load_corpus_rejects_other_parameters(tmp_path):
+    root = str(tmp_path / "corpus")
+    load_corpus("test", root=root, no_samples=4)
+
+    assert len(load_corpus("test", root=root, no_samples=4, dtype=np.float16)) == 4
+    with pytest.raises(ValueError, match="no_samples=4"):
+        load_corpus("test", root=root, no_samples=8)
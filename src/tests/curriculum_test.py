@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from src.curriculum import make_curriculum_batch
+from src.curriculum import NoiseCurriculum
+from src.curriculum import ShipBank
+from src.helpers import make_data_batch
+
+
+def test_ship_bank():
+    bank = ShipBank(50, rng=np.random.default_rng(0))
+    rng = np.random.default_rng(1)
+
+    imgs, labels = make_curriculum_batch(bank, 20, noise_level=0, no_lines=0, rng=rng)
+    ships = ~np.isnan(labels[:, 0])
+    assert ships.any() and not ships.all()
+
+    # every ship image holds exactly the banked pixels
+    for img, label in zip(imgs[ships], labels[ships]):
+        (index,) = np.flatnonzero((bank.labels == label).all(axis=1))[:1]
+        pixels = slice(bank.offsets[index], bank.offsets[index + 1])
+        np.testing.assert_array_equal(np.flatnonzero(img), np.sort(bank.pixels[pixels]))
+    assert not imgs[~ships].any()
+
+    # the same ship is drawn with fresh intensities every time
+    imgs = np.zeros((2, 200, 200))
+    bank.draw(imgs, np.arange(2), np.array([3, 3]), rng)
+    np.testing.assert_array_equal(imgs[0] > 0, imgs[1] > 0)
+    assert not np.array_equal(imgs[0], imgs[1])
+
+
+def test_curriculum_distribution():
+    rng = np.random.default_rng(0)
+    bank = ShipBank(2000, rng=rng)
+
+    imgs, labels = make_curriculum_batch(bank, 300, rng=rng, dtype=np.float32)
+    ref_imgs, ref_labels = make_data_batch(300, rng=rng, dtype=np.float32)
+
+    # pixels brighter than the background noise are ship or line pixels
+    bright, ref_bright = (imgs > 0.8).sum(axis=(1, 2)), (ref_imgs > 0.8).sum(axis=(1, 2))
+    assert bright.mean() == pytest.approx(ref_bright.mean(), rel=0.1)
+    assert imgs.mean() == pytest.approx(ref_imgs.mean(), rel=0.01)
+    assert np.nanmean(labels, axis=0) == pytest.approx(np.nanmean(ref_labels, axis=0), rel=0.1)
+
+
+def test_noise_schedule():
+    curriculum = NoiseCurriculum(ShipBank(10), ramp_epochs=4)
+
+    assert curriculum.schedule(0) == (0.2, 0)
+    assert curriculum.schedule(2) == pytest.approx((0.5, 3))
+    assert curriculum.schedule(4) == curriculum.schedule(40) == (0.8, 6)
+
+    curriculum.on_epoch_begin(1)
+    assert (curriculum.noise_level, curriculum.no_lines) == pytest.approx((0.35, 2))
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+keras = pytest.importorskip("tensorflow").keras
+
+from src.distill import gen_student
+from src.distill import make_distillation_batch
+from src.main import post_processing_batch
+
+
+def test_student_mirrors_the_teacher_outputs(make_model):
+    # the position head is unbounded
+    teacher = make_model(activations=("tanh", None, "tanh", "tanh"))
+    student = gen_student(teacher, nfilters=1, hidden=4)
+
+    assert [o.shape[-1] for o in student.outputs] == [1, 2, 2, 2]
+    assert student.output_names == ["detection", "position", "angle", "area"]
+    activations = [student.get_layer(name).activation for name in student.output_names]
+    assert activations[1] is keras.activations.linear
+    assert all(a is keras.activations.tanh for a in activations[::2] + activations[3:])
+
+    imgs, targets = make_distillation_batch(teacher, batch_size=4)
+    assert [t.shape for t in targets] == [(4, 1), (4, 2), (4, 2), (4, 2)]
+    assert not any(np.isnan(t).any() for t in targets)
+
+    preds = post_processing_batch(student.predict(imgs, verbose=0))
+    assert preds.shape == (4, 5)
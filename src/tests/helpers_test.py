@@ -0,0 +1,134 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+from skimage.draw import line
+
+from src import helpers
+from src.helpers import _get_l2w
+from src.helpers import _get_pos
+from src.helpers import _get_size
+from src.helpers import _get_t2l
+from src.helpers import _get_yaw
+from src.helpers import _line_pixels
+from src.helpers import _make_spaceship
+from src.helpers import _make_spaceships
+from src.helpers import _perimeter_pixels
+from src.helpers import analyze
+from src.helpers import close_pools
+from src.helpers import make_data
+from src.helpers import make_data_batch
+from src.helpers import make_data_stream
+from src.helpers import OUTCOMES
+from src.helpers import sample_rng
+from src.helpers import score_batch
+from src.helpers import score_iou
+
+
+def test_line_pixels_match_skimage():
+    ends = np.random.randint(-20, 220, size=(500, 4))
+    seg, rr, cc = _line_pixels(*ends.T)
+
+    for ii, end in enumerate(ends):
+        ref_rr, ref_cc = line(*end)
+        assert np.array_equal(rr[seg == ii], ref_rr)
+        assert np.array_equal(cc[seg == ii], ref_cc)
+
+
+def test_perimeter_pixels_match_skimage():
+    pytest.importorskip("matplotlib")  # required by skimage's polygon clipping
+    from skimage.draw import polygon_perimeter
+
+    n = 200
+    params = (_get_pos(200, n), _get_yaw(n), _get_size(n), _get_l2w(n), _get_t2l(n))
+    pts, labels = _make_spaceships(*params)
+    idx, rr, cc = _perimeter_pixels(pts)
+
+    for ii in range(n):
+        ref_pts, ref_label = _make_spaceship(*(p[ii] for p in params))
+        ref_rr, ref_cc = polygon_perimeter(ref_pts[:, 0], ref_pts[:, 1])
+        assert np.allclose(labels[ii], ref_label)
+        assert np.array_equal(rr[idx == ii], ref_rr)
+        assert np.array_equal(cc[idx == ii], ref_cc)
+
+
+def test_make_data_batch():
+    imgs, labels = make_data_batch(16, has_spaceship=True, noise_level=0, no_lines=0)
+
+    assert imgs.shape == (16, 200, 200)
+    assert labels.shape == (16, 5)
+    assert not np.isnan(labels).any()
+    assert imgs.min() >= 0 and imgs.max() <= 1
+    assert all(img.any() for img in imgs)
+
+    imgs, labels = make_data_batch(8, has_spaceship=False)
+    assert np.isnan(labels).all()
+
+
+def test_sample_rng_is_reproducible():
+    children = np.random.SeedSequence(7).spawn(3)[2].spawn(5)
+    expected = np.random.Generator(np.random.PCG64(children[4])).random(4)
+
+    assert np.array_equal(sample_rng(7, stream=2, index=4).random(4), expected)
+
+    stream = make_data_stream(7, stream=1)
+    samples = [next(stream) for _ in range(3)]
+    img, label = make_data(rng=sample_rng(7, stream=1, index=2))
+    assert np.array_equal(img, samples[2][0])
+    np.testing.assert_array_equal(label, samples[2][1])
+
+    a = make_data_batch(4, rng=sample_rng(7, index=0), dtype=np.float32)
+    b = make_data_batch(4, rng=sample_rng(7, index=0), dtype=np.float32)
+    assert a[0].dtype == np.float32
+    assert np.array_equal(a[0], b[0])
+
+
+@pytest.fixture
+def shared_pools():
+    yield
+    close_pools()
+
+
+@pytest.mark.parametrize(
+    "processes,chunk_size,executor", [(1, 256, False), (2, 16, False), (1, 16, True)]
+)
+def test_score_batch_matches_score_iou_and_analyze(processes, chunk_size, executor, shared_pools):
+    _, labels = make_data_batch(200, has_spaceship=True, rng=sample_rng(0))
+    preds = labels + sample_rng(1).normal(0, [10, 10, 0.5, 3, 3], size=labels.shape)
+    preds[::3, :2] = labels[::3, :2] + 100  # disjoint boxes
+    labels[::7] = np.nan  # FP and TN
+    preds[::5] = np.nan  # FN and TN
+    preds[1, 3:] = 0  # degenerate box
+
+    if executor:
+        with ProcessPoolExecutor(2, mp_context=mp.get_context("spawn")) as pool:
+            ious, outcomes = score_batch(preds, labels, chunk_size=chunk_size, pool=pool)
+    else:
+        ious, outcomes = score_batch(preds, labels, processes=processes, chunk_size=chunk_size)
+
+    assert outcomes.dtype == np.int8
+    for pred, label, iou, outcome in zip(preds, labels, ious, outcomes):
+        expected = score_iou(pred, label)
+        assert np.isnan(iou) if expected is None else iou == expected
+        if not np.isnan(label).any():
+            assert OUTCOMES[outcome] == analyze(pred.copy(), label.copy())
+        else:
+            assert OUTCOMES[outcome] == ("TN" if np.isnan(pred).any() else "FP")
+
+
+def test_score_batch_reuses_the_shared_pool(shared_pools):
+    _, labels = make_data_batch(64, has_spaceship=True, rng=sample_rng(0))
+    preds = labels + sample_rng(1).normal(0, [10, 10, 0.5, 3, 3], size=labels.shape)
+
+    first = score_batch(preds, labels, processes=2, chunk_size=8)
+    pool = helpers._pools[2]
+    second = score_batch(preds, labels, processes=2, chunk_size=8)
+
+    assert helpers._pools[2] is pool
+    np.testing.assert_array_equal(first[0], second[0])
+
+    workers = list(pool._pool)
+    close_pools()
+    assert helpers._pools == {}
+    assert not any(worker.is_alive() for worker in workers)
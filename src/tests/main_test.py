@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from src.corpus import build_corpus
+from src.main import eval
+from src.main import operating_point
+from src.main import threshold_sweep
+
+
+def test_threshold_sweep():
+    rng = np.random.default_rng(0)
+    scores = np.round(rng.normal(size=200), 1)  # ties
+    ious = rng.uniform(size=200)
+    ious[rng.uniform(size=200) < 0.2] = np.nan
+
+    sweep = threshold_sweep(scores, ious)
+    assert sweep["threshold"][-1] == -np.inf
+    assert sweep["IOU-GOOD"][0] == sweep["FP"][0] == 0
+
+    for threshold in [-np.inf, -1.05, 0.0, 0.3, 10.0]:
+        detected = scores > threshold
+        positive = ~np.isnan(ious)
+        good = detected & positive & (np.nan_to_num(ious) > 0.7)
+        index = operating_point(sweep, threshold)
+
+        assert sweep["TN"][index] == (~detected & ~positive).sum()
+        assert sweep["FP"][index] == (detected & ~positive).sum()
+        assert sweep["FN"][index] == (~detected & positive).sum()
+        assert sweep["IOU-GOOD"][index] == good.sum()
+        assert sweep["IOU-BAD"][index] == (detected & positive).sum() - good.sum()
+        assert sweep["ap"][index] == pytest.approx(good.sum() / (~(~detected & ~positive)).sum())
+
+
+def test_eval_on_fresh_samples(tmp_path, monkeypatch, capsys, save_model):
+    save_model(str(tmp_path / "model"))
+
+    monkeypatch.chdir(tmp_path)
+    eval(str(tmp_path / "model"), corpus=None)
+
+    assert "True Negatives" in capsys.readouterr().out
+    assert not (tmp_path / "save").exists()  # fresh samples are neither stored nor cached
+
+
+def test_eval_leaves_the_corpus_untouched(tmp_path, monkeypatch, capsys, save_model):
+    save_model(str(tmp_path / "model"))
+    monkeypatch.chdir(tmp_path)
+    corpus = build_corpus("test", no_samples=16, root=str(tmp_path / "corpus"))
+    labels = corpus.labels.copy()
+
+    eval(str(tmp_path / "model"), corpus=corpus)
+    first = capsys.readouterr().out
+    eval(str(tmp_path / "model"), corpus=corpus)
+    second = capsys.readouterr().out
+
+    np.testing.assert_array_equal(corpus.labels, labels)
+    assert second[second.index("---") :] == first[first.index("---") :]
+    with pytest.raises(ValueError, match="read-only"):
+        corpus.labels[0, 2] = 0
@@ -0,0 +1,88 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from src.memprof import MemoryProfiler
+from src.memprof import stage
+
+
+@pytest.fixture
+def profiler():
+    with MemoryProfiler() as profiler:
+        yield profiler
+
+
+def test_growth_flags_stages_that_scale_with_n(profiler):
+    for n in (100, 200, 400):
+        with profiler.stage("linear", n):
+            x = np.ones((n, 10000))
+            del x
+        with profiler.stage("constant", n):
+            x = np.ones((100, 10000))
+            del x
+
+    growth = profiler.growth()
+    assert growth["linear"]["flagged"]
+    assert np.isclose(growth["linear"]["bytes_per_sample"], 80000, rtol=0.05)
+    assert not growth["constant"]["flagged"]
+
+
+def test_report_writes_json(tmp_path, profiler):
+    with stage(profiler, "alloc", 10):
+        x = np.ones((10, 1000))
+    with stage(None, "skipped", 10):
+        pass
+
+    path = tmp_path / "report.json"
+    report = profiler.report(str(path))
+
+    assert json.loads(path.read_text()) == report
+    (record,) = report["stages"]
+    assert record["name"] == "alloc" and record["n"] == 10
+    assert record["py_net"] >= x.nbytes
+    assert report["growth"] == {}
+
+
+def test_rss_peak_is_relative_to_the_stage(profiler):
+    with profiler.stage("large"):
+        x = np.ones(50 * 2**20 // 8)  # 50 MiB, touched
+        del x
+    with profiler.stage("small"):
+        pass
+
+    large, small = profiler.records
+    assert 40 * 2**20 < large.rss_peak < 100 * 2**20
+    assert 0 <= small.rss_peak <= large.rss_peak
+
+
+def test_close_stops_only_its_own_tracing():
+    if tracemalloc.is_tracing():
+        pytest.skip("tracemalloc is already tracing")
+
+    with MemoryProfiler():
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+
+    tracemalloc.start()
+    try:
+        with MemoryProfiler():
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_tf_memory_gap_is_reported_on_cpu(profiler, capsys):
+    tf = pytest.importorskip("tensorflow")
+    if tf.config.list_logical_devices("GPU"):
+        pytest.skip("TensorFlow has a GPU")
+
+    with profiler.stage("cpu"):
+        pass
+    report = profiler.report()
+
+    assert report["stages"][0]["tf_memory"] is None
+    assert report["tf_memory_gaps"] == ["TensorFlow has no allocator stats for the CPU"]
+    assert "TensorFlow memory not recorded" in capsys.readouterr().out
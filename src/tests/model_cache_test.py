@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from src.model_cache import ModelCache
+
+
+@pytest.mark.parametrize("key", ["mtime", "hash"])
+def test_model_cache(tmp_path, key, save_model):
+    path = str(tmp_path / "model")
+    save_model(path)
+    cache = ModelCache(maxsize=1, key=key)
+
+    model = cache.load(path)
+    assert cache.load(path) is model
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # clones share the weights but not the layers
+    copy = cache.load(path, clone=True)
+    assert copy is not model
+    assert copy.layers[-1] is not model.layers[-1]
+    copy.layers[-1]._name = "renamed"
+    assert model.layers[-1].name != "renamed"
+    for w, w_copy in zip(model.get_weights(), copy.get_weights()):
+        np.testing.assert_array_equal(w, w_copy)
+
+    # overwritten on disk
+    saved = save_model(path)
+    reloaded = cache.load(path)
+    assert reloaded is not model
+    np.testing.assert_array_equal(reloaded.get_weights()[0], saved.get_weights()[0])
+
+    # least recently used model is evicted
+    save_model(str(tmp_path / "other"))
+    cache.load(str(tmp_path / "other"))
+    assert len(cache) == 1
+    assert cache.load(path) is not reloaded
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+keras = pytest.importorskip("tensorflow").keras
+
+from src.helpers import make_data_batch
+from src.helpers import sample_rng
+from src.online_eval import BackgroundAP
+
+
+def _compiled(model):
+    model.compile(loss="mse", optimizer=keras.optimizers.SGD(0.01))
+    return model
+
+
+def _fit(model, callback, epochs):
+    imgs = np.random.rand(8, 200, 200).astype(np.float32)
+    targets = [np.zeros((8, k), dtype=np.float32) for k in (1, 2, 2, 2)]
+    return model.fit(imgs, targets, batch_size=4, epochs=epochs, callbacks=[callback], verbose=0)
+
+
+def test_background_ap_saves_best_snapshot(tmp_path, make_model):
+    imgs, labels = make_data_batch(32, rng=sample_rng(0), dtype=np.float32)
+    path = str(tmp_path / "best.h5")
+    model = _compiled(make_model())
+    callback = BackgroundAP(imgs, labels, filepath=path, restore_best_weights=True)
+
+    _fit(model, callback, epochs=4)
+
+    assert 3 in callback.scores
+    assert sorted([*callback.scores, *callback.skipped]) == [0, 1, 2, 3]
+    assert callback.best == max(callback.scores.values())
+    assert callback.score(keras.models.load_model(path, compile=False)) == callback.best
+    assert callback.score(model) == callback.best
+
+
+def test_background_ap_stops_early(make_model):
+    imgs, labels = make_data_batch(32, rng=sample_rng(0), dtype=np.float32)
+    model = _compiled(make_model())
+    model.optimizer.learning_rate = 0.0  # the AP never improves
+    callback = BackgroundAP(imgs, labels, patience=2)
+
+    history = _fit(model, callback, epochs=50)
+
+    assert callback.stopped_epoch is not None
+    assert len(history.epoch) < 50
+
+
+def test_train_model_checkpoints_on_ap(tmp_path, monkeypatch, make_head):
+    import src.online_eval
+    from src.train import train_model
+
+    instances = []
+
+    class Spy(BackgroundAP):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            instances.append(self)
+
+    monkeypatch.setattr(src.online_eval, "BackgroundAP", Spy)
+
+    path = str(tmp_path / "position")
+    train_model(
+        batch_size=4,
+        model_path=path,
+        steps_per_epoch=1,
+        epochs=2,
+        variables=["x", "y"],
+        base_model=make_head,
+        seed=0,
+        ap_samples=16,
+    )
+
+    # the model path holds the best AP snapshot, no loss checkpoint overwrote it
+    (callback,) = instances
+    assert callback.best_epoch is not None
+    assert callback.score(keras.models.load_model(path, compile=False)) == callback.best
+
+    with pytest.raises(ValueError):
+        train_model(model_path=path, patience=2)
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+keras = pytest.importorskip("tensorflow").keras
+
+from src.prune import count_flops
+from src.prune import count_params
+from src.helpers import make_data_batch
+from src.helpers import sample_rng
+from src.main import average_precision
+from src.main import head_predictions
+from src.prune import fine_tune
+from src.prune import prune_model
+from src.prune import report
+
+
+def test_prune_model_removes_dead_channels():
+    model = keras.Sequential(
+        [
+            keras.layers.Reshape((16, 16, 1), input_shape=(16, 16)),
+            keras.layers.Conv2D(8, 3, strides=2, activation="relu"),
+            keras.layers.Conv2D(4, 3, strides=2, activation="relu"),
+            keras.layers.Flatten(),
+            keras.layers.Dense(6, activation="relu"),
+            keras.layers.Dense(2),
+        ]
+    )
+
+    # zero out half of the filters and units so that pruning them does not change the output
+    for layer in model.layers[1:3] + model.layers[4:5]:
+        kernel, bias = layer.get_weights()
+        kernel[..., ::2] = 0
+        bias[::2] = 0
+        layer.set_weights([kernel, bias])
+
+    pruned = prune_model(model, 0.5)
+
+    assert [layer.get_weights()[0].shape[-1] for layer in pruned.layers[2:4]] == [4, 2]
+    assert pruned.layers[-2].get_weights()[0].shape == (2 * 3 * 3, 3)
+    assert count_params(pruned) < count_params(model)
+    assert count_flops(pruned) < count_flops(model)
+
+    x = np.random.rand(4, 16, 16).astype(np.float32)
+    np.testing.assert_allclose(pruned.predict(x), model.predict(x), atol=1e-5)
+
+
+def test_fine_tune_trains_the_given_head_with_its_recipe(make_head):
+    model = make_head()
+    before = [w.copy() for w in model.get_weights()]
+
+    tuned = fine_tune(model, "area", steps_per_epoch=1, epochs=1, batch_size=4, learning_rate=0.1)
+
+    assert tuned is model
+    assert tuned.optimizer.learning_rate.numpy() == pytest.approx(0.1)
+    assert not np.allclose(tuned.get_weights()[0], before[0])
+
+
+def test_report_scores_every_head_on_its_own(make_head):
+    models = {
+        "detection": make_head(1),
+        "position": make_head(),
+        "angle": make_head(),
+        "area": make_head(),
+    }
+    names = {name: [layer.name for layer in model.layers] for name, model in models.items()}
+    imgs, labels = make_data_batch(16, rng=sample_rng(0), dtype=np.float32)
+
+    first = report(models, imgs, labels)
+    second = report(models, imgs, labels)
+
+    assert {name: [layer.name for layer in model.layers] for name, model in models.items()} == names
+    outputs = models["position"].predict(2 * imgs - 1, verbose=0)
+    expected = average_precision(head_predictions(outputs, labels, ["x", "y"]), labels)
+    assert first["position"]["ap"] == second["position"]["ap"] == expected
+    assert first["combined"]["ap"] == second["combined"]["ap"]
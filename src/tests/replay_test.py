@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from src.replay import ReplayBuffer
+
+
+def generate(n: int):
+    return np.random.rand(n, 4, 4), np.random.rand(n, 2)
+
+
+def test_replay_mixes_fresh_and_replayed_samples():
+    buffer = ReplayBuffer(capacity=32, fresh_fraction=0.25, rng=np.random.default_rng(0))
+
+    imgs, labels = buffer.make_batch(generate, 8)
+    assert imgs.shape == (8, 4, 4) and labels.shape == (8, 2)
+    assert len(buffer) == 8  # all fresh until the buffer can fill a batch
+
+    buffer.make_batch(generate, 8)
+    assert len(buffer) == 10
+
+    for _ in range(2):
+        buffer.update(np.ones(8))
+    assert not buffer.pending
+
+
+def test_replay_prefers_hard_samples():
+    buffer = ReplayBuffer(capacity=16, fresh_fraction=0.5, rng=np.random.default_rng(0))
+    buffer.make_batch(generate, 16)
+
+    losses = np.full(16, 1e-6)
+    losses[3] = 10.0
+    buffer.update(losses)
+
+    counts = np.zeros(16)
+    for _ in range(200):
+        counts[buffer.sample(1)] += 1
+    assert counts.argmax() == 3
+
+
+@pytest.mark.parametrize("eviction", ["age", "priority"])
+def test_replay_eviction(eviction: str):
+    buffer = ReplayBuffer(capacity=8, eviction=eviction)
+    buffer.add(*generate(8))
+    buffer.priority[:] = np.arange(8)
+
+    slots = buffer.add(*generate(2))
+    assert len(buffer) == 8
+    assert sorted(slots) == [0, 1]
+
+    # a stale batch does not overwrite the priorities of the new samples
+    buffer.pending.append((slots, buffer.uid[slots] - 100))
+    buffer.update(np.full(2, 5.0))
+    assert np.all(buffer.priority[slots] != 5.0)
+
+
+def test_replay_producer_and_updates_on_separate_threads():
+    import threading
+
+    buffer = ReplayBuffer(capacity=16, eviction="priority", rng=np.random.default_rng(0))
+    built = threading.Semaphore(0)
+
+    def produce():
+        for _ in range(200):
+            buffer.make_batch(generate, 8)
+            built.release()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    for ii in range(200):
+        built.acquire()
+        buffer.update(np.full(8, float(ii)))
+    producer.join()
+
+    assert not buffer.pending
+    assert len(buffer) == 16
+    assert np.all(buffer.priority <= 199)
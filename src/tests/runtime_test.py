@@ -0,0 +1,42 @@
+import pytest
+
+from src.runtime import _parse_cpulist
+from src.runtime import core_sets
+
+
+def test_parse_cpulist():
+    assert _parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+
+
+def test_core_sets():
+    assert core_sets(2, [0, 1, 2, 3, 8, 9]) == [[0, 1, 2], [3, 8, 9]]
+
+    with pytest.raises(ValueError):
+        core_sets(3, [0, 1])
+
+
+def test_data_workers_use_their_own_streams():
+    pytest.importorskip("tensorflow")
+    import numpy as np
+
+    from src.helpers import sample_rng
+    from src.runtime import DataWorkers
+    from src.runtime import RuntimeConfig
+    from src.runtime import WORKER_STREAM
+    from src.train import make_batch
+
+    with DataWorkers(RuntimeConfig(data_workers=1), seed=0) as workers:
+        imgs, _ = workers(4)
+
+    expected, _ = make_batch(batch_size=4, rng=sample_rng(0, WORKER_STREAM, 0))
+    in_process, _ = make_batch(batch_size=4, rng=sample_rng(0, 0, 0))
+    np.testing.assert_array_equal(imgs, expected)
+    assert not np.array_equal(imgs, in_process)
+
+
+def test_replica_pool_raises_when_a_replica_dies(tmp_path):
+    pytest.importorskip("tensorflow")
+    from src.runtime import ReplicaPool
+
+    with pytest.raises(RuntimeError, match="exit code 1"):
+        ReplicaPool(str(tmp_path / "missing"), replicas=1, cores=[0], timeout=0.1)
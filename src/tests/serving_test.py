@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from src.helpers import make_data_batch
+from src.main import predict
+from src.serving import export_serving_model
+from src.serving import ServingModel
+
+
+def test_serving_model_matches_post_processing(tmp_path, make_model):
+    model = make_model(input_shape=(200, 200, 1))
+
+    # make sure there are both detections and non-detections
+    detection = model.get_layer(model.output_names[0])
+    kernel, _ = detection.get_weights()
+    detection.set_weights([kernel, np.zeros(1)])
+    model.save(tmp_path / "model")
+
+    export_serving_model(str(tmp_path / "model"), str(tmp_path / "serving"))
+    serving = ServingModel(str(tmp_path / "serving"), warmup_batch_sizes=(1,))
+
+    imgs, _ = make_data_batch(16)
+    expected = predict(model, imgs)
+
+    np.testing.assert_allclose(serving(imgs), expected, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from src.main import post_processing_batch
+from src.stream import frame_source
+from src.stream import StreamingPredictor
+
+
+@pytest.mark.parametrize("reuse_tolerance", [None, 0.0])
+def test_streaming_predictor(reuse_tolerance, make_model):
+    model = make_model()
+    frames = list(frame_source(30, repeat=0.5, seed=0))
+    expected = post_processing_batch(model.predict(2 * np.stack(frames) - 1, verbose=0))
+
+    predictor = StreamingPredictor(model, max_batch=4, reuse_tolerance=reuse_tolerance)
+    preds = np.stack(list(predictor(iter(frames))))
+
+    np.testing.assert_allclose(preds, expected, rtol=1e-4)
+    assert len(predictor.latencies) == 30
+    assert (predictor.reused > 0) == (reuse_tolerance is not None)
+
+
+def test_streaming_predictor_errors(make_model):
+    def frames():
+        yield np.zeros((200, 200))
+        raise RuntimeError("camera lost")
+
+    with pytest.raises(RuntimeError, match="camera lost"):
+        list(StreamingPredictor(make_model())(frames()))
+
+
+def test_streaming_predictor_early_exit(make_model):
+    predictor = StreamingPredictor(make_model())
+    preds = predictor(frame_source(seed=0))
+
+    assert next(preds).shape == (5,)
+    preds.close()  # joins the worker threads
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from src.sweep import _sweep_dir
+from src.sweep import make_trials
+
+
+def test_make_trials_grid():
+    trials = make_trials({"batch_size": [64, 128], "epochs": [25, 50, 100]})
+
+    assert len(trials) == 6
+    assert trials[0] == {"batch_size": 64, "epochs": 25}
+
+
+def test_make_trials_random():
+    space = {"learning_rate": (1e-5, 1e-3), "epochs": (2, 5), "batch_size": [64, 128]}
+    trials = make_trials(space, n_trials=20, seed=1)
+
+    assert trials == make_trials(space, n_trials=20, seed=1)
+    for trial in trials:
+        assert 1e-5 <= trial["learning_rate"] <= 1e-3
+        assert trial["epochs"] in range(2, 6)
+        assert trial["batch_size"] in (64, 128)
+
+    with pytest.raises(ValueError):
+        make_trials(space)
+
+
+def test_sweep_dir_is_keyed_on_the_sweep_parameters(tmp_path):
+    config = {"space": {"learning_rate": (1e-5, 1e-3)}, "n_trials": 4, "seed": 0}
+    path = _sweep_dir(str(tmp_path), "position", config)
+
+    assert path.startswith(f"{tmp_path}/position/")
+    with pytest.raises(FileExistsError):
+        _sweep_dir(str(tmp_path), "position", config)
+    assert _sweep_dir(str(tmp_path), "position", {**config, "seed": 1}) != path
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+keras = tf.keras
+
+from src.train import accumulate_gradients
+from src.train import scale_learning_rate
+
+
+def _model(batch_norm=False):
+    inputs = keras.Input(shape=(3,))
+    x = keras.layers.Dense(4, kernel_initializer="ones")(inputs)
+    if batch_norm:
+        # nested like the BatchNormalization of the stacked heads
+        x = keras.Sequential([keras.layers.BatchNormalization(momentum=0.9)])(x)
+    model = keras.Model(inputs, keras.layers.Dense(1, kernel_initializer="ones")(x))
+    model.compile(loss="mse", optimizer=keras.optimizers.SGD(learning_rate=0.01))
+    return model
+
+
+def test_accumulate_gradients():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(32, 3)).astype(np.float32)
+    y = rng.normal(size=(32, 1)).astype(np.float32)
+
+    # one update on the full batch
+    full = _model()
+    full.fit(x, y, batch_size=32, epochs=1, shuffle=False, verbose=0)
+
+    # four micro-batches, one update
+    micro = _model()
+    callback = accumulate_gradients(micro, 4)
+    micro.fit(x, y, batch_size=8, epochs=1, shuffle=False, verbose=0, callbacks=[callback])
+
+    for w_full, w_micro in zip(full.get_weights(), micro.get_weights()):
+        np.testing.assert_allclose(w_micro, w_full, rtol=1e-5, atol=1e-6)
+
+
+def test_accumulate_gradients_batch_norm():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(8, 3)).astype(np.float32)
+    y = rng.normal(size=(8, 1)).astype(np.float32)
+
+    # one step on the full batch
+    full = _model(batch_norm=True)
+    full.fit(x, y, batch_size=8, epochs=1, verbose=0)
+
+    # the same batch as four micro-batches, so every micro-batch has the full batch statistics
+    micro = _model(batch_norm=True)
+    callback = accumulate_gradients(micro, 4)
+    micro.fit(
+        np.tile(x, (4, 1)),
+        np.tile(y, (4, 1)),
+        batch_size=8,
+        epochs=1,
+        shuffle=False,
+        verbose=0,
+        callbacks=[callback],
+    )
+
+    norm_full, norm_micro = full.layers[2].layers[0], micro.layers[2].layers[0]
+    assert not np.allclose(norm_full.moving_mean.numpy(), 0)
+    np.testing.assert_allclose(
+        norm_micro.moving_mean.numpy(), norm_full.moving_mean.numpy(), rtol=1e-5
+    )
+    np.testing.assert_allclose(
+        norm_micro.moving_variance.numpy(), norm_full.moving_variance.numpy(), rtol=1e-5
+    )
+    assert norm_micro.momentum == 0.9
+
+
+def test_accumulate_gradients_drops_partial_updates_at_epoch_end():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(24, 3)).astype(np.float32)
+    y = rng.normal(size=(24, 1)).astype(np.float32)
+
+    # three micro-batches per epoch, the third never completes an update
+    model = _model()
+    callback = accumulate_gradients(model, 2)
+    model.fit(x, y, batch_size=8, epochs=2, shuffle=False, verbose=0, callbacks=[callback])
+
+    assert model.optimizer.iterations.numpy() == 2
+
+
+def test_scale_learning_rate():
+    assert scale_learning_rate(1e-3, 4, "linear") == pytest.approx(4e-3)
+    assert scale_learning_rate(1e-3, 4, "sqrt") == pytest.approx(2e-3)
+    assert scale_learning_rate(1e-3, 4, "none") == 1e-3
+    with pytest.raises(ValueError):
+        scale_learning_rate(1e-3, 4, "cubic")
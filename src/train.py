@@ -1,6 +1,10 @@
+import contextlib
+import itertools
+import types
 from collections.abc import Callable
 from copy import deepcopy
 from os.path import exists
+from typing import Optional
 from typing import Tuple
 
 import names
@@ -18,11 +22,19 @@ from tensorflow.keras.layers import Flatten
 from tensorflow.keras.layers import Input
 from tensorflow.keras.layers import MaxPool2D
 from tensorflow.keras.layers import Reshape
-from tensorflow.keras.models import load_model
 from tensorflow.keras.models import Model
 from tensorflow.keras.models import Sequential
 
-from src.helpers import make_data
+from src.curriculum import NoiseCurriculum
+from src.helpers import make_data_batch
+from src.helpers import sample_rng
+from src.memprof import MemoryProfiler
+from src.memprof import stage
+from src.model_cache import load_cached_model
+from src.replay import ReplayBuffer
+from src.runtime import configure
+from src.runtime import DataWorkers
+from src.runtime import RuntimeConfig
 
 
 def replace_inputs(inputs: tf.Tensor, model: Model) -> tf.Tensor:
@@ -56,48 +68,47 @@ def combine_models() -> Model:
         Model: The hydra model.
     """
 
-    IMAGE_SIZE = 200
+    model = stack_models([load_cached_model(RECIPES[head][1], clone=True) for head in HEADS])
 
-    model_path1 = "save/best_model_detection"
-    model_path2 = "save/best_model_position"
-    model_path3 = "save/best_model_angle"
-    model_path4 = "save/best_model_area"
+    model.save("save/best_combined_model.hd5")
 
-    inputs = Input(shape=(IMAGE_SIZE, IMAGE_SIZE, 1))
+    return model
 
-    if exists(model_path1 + "/saved_model.pb"):
-        model1 = load_model(model_path1)
-    if exists(model_path2 + "/saved_model.pb"):
-        model2 = load_model(model_path2)
-    if exists(model_path3 + "/saved_model.pb"):
-        model3 = load_model(model_path3)
-    if exists(model_path4 + "/saved_model.pb"):
-        model4 = load_model(model_path4)
 
-    x1 = replace_inputs(inputs, model1)
-    x2 = replace_inputs(inputs, model2)
-    x3 = replace_inputs(inputs, model3)
-    x4 = replace_inputs(inputs, model4)
+def stack_models(models: list) -> Model:
+    """Stack models that share the same input into a single model with one output per model.
+
+    Args:
+        models (list): Detection, position, angle and area models, in the order expected by `post_processing`.
+
+    Returns:
+        Model: The hydra model.
+    """
+
+    IMAGE_SIZE = 200
+
+    inputs = Input(shape=(IMAGE_SIZE, IMAGE_SIZE, 1))
 
     model = tf.keras.Model(
         inputs=inputs,
-        outputs=[x1, x2, x3, x4],
+        outputs=[replace_inputs(inputs, m) for m in models],
     )
 
-    model.save("save/best_combined_model.hd5")
-
     return model
 
 
-def gen_base_model() -> Model:
+def gen_base_model(nfilters: int = 8) -> Model:
     """The base model.
 
+    Args:
+        nfilters (int, optional): Width multiplier of the conv trunk. Defaults to 8.
+
     Returns:
         Model: Base model.
     """
 
     IMAGE_SIZE = 200
-    NFILTERS = 8
+    NFILTERS = nfilters
 
     CONV_PARAMS_1 = {
         "kernel_size": 3,
@@ -144,7 +155,7 @@ def gen_position() -> Model:
     model_path = "save/base_model"
 
     if exists(model_path + "/saved_model.pb"):
-        model = load_model(model_path)
+        model = load_cached_model(model_path, clone=True)
 
     x = model.layers[-5].output
     x = Dense(100, name="d2")(x)
@@ -171,7 +182,7 @@ def gen_area() -> Model:
     model_path = "save/base_model"
 
     if exists(model_path + "/saved_model.pb"):
-        model = load_model(model_path)
+        model = load_cached_model(model_path, clone=True)
 
     x = model.layers[-5].output
     x = Dense(100, name="d1")(x)
@@ -195,7 +206,7 @@ def gen_detect() -> Model:
     model_path = "save/base_model"
 
     if exists(model_path + "/saved_model.pb"):
-        model = load_model(model_path)
+        model = load_cached_model(model_path, clone=True)
 
     x = model.layers[-5].output
     x = Dense(100, name="d1")(x)
@@ -219,7 +230,7 @@ def gen_angle() -> Model:
     model_path = "save/base_model"
 
     if exists(model_path + "/saved_model.pb"):
-        model = load_model(model_path)
+        model = load_cached_model(model_path, clone=True)
 
     x = model.layers[-5].output
     x = Dense(100, name="d1")(x)
@@ -336,6 +347,9 @@ def make_batch(
     has_spaceship: bool = True,
     noise_level: float = 0.8,
     variables: list = ["x", "y", "yaw", "width", "height", "sin", "cos"],
+    rng: Optional[np.random.Generator] = None,
+    curriculum: Optional[NoiseCurriculum] = None,
+    profiler: Optional[MemoryProfiler] = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """The training data is produce by this fuction.
 
@@ -344,6 +358,9 @@ def make_batch(
         has_spaceship (bool, optional): Flag to indicate if spaceship exists. Defaults to True.
         noise_level (float, optional): Noise level in image. Defaults to 0.8.
         variables (list, optional): Variables of interest. Defaults to ["x", "y", "yaw", "width", "height", "sin", "cos"].
+        rng (np.random.Generator, optional): Random generator, see `sample_rng`. Defaults to None (global `np.random` state).
+        curriculum (NoiseCurriculum, optional): Composite banked ships at the curriculum noise, `noise_level` is ignored. Defaults to None.
+        profiler (MemoryProfiler, optional): Records the memory of the generation and labelling stages. Defaults to None.
 
     Raises:
         ValueError: Check for invalid ranges in input image.
@@ -354,51 +371,57 @@ def make_batch(
         tuple: The image array and the filtered array.
     """
 
-    # This data generation process has been modified to work with spaceship or no spaceship
-    imgs, labels = zip(
-        *[
-            make_data(has_spaceship=has_spaceship, noise_level=noise_level)
-            for _ in range(batch_size)
-        ]
-    )
-
-    # fmt: off
-    imgs        = np.stack(imgs)
-    labels      = np.stack(labels)
-    imgs        = 2 * imgs - 1       # normalize image
-    labels      = add_angle_labels(batch_size, labels)
-    labels      = add_detection_labels(batch_size, labels)
-    all_names   = ["x", "y", "yaw", "width", "height", "sin", "cos", "detection"]
-
-    # normalization of outputs
-    x           = normalization(min_x=10, max_x=190,        inputs=labels[:, 0])
-    y           = normalization(min_x=10, max_x=190,        inputs=labels[:, 1])
-    yaw         = normalization(min_x=0,  max_x=2*np.pi,    inputs=labels[:, 2])
-    width       = normalization(min_x=18, max_x=36,         inputs=labels[:, 3])
-    height      = normalization(min_x=18, max_x=75,         inputs=labels[:, 4])
-    sin         = normalization(min_x=-1, max_x=1,          inputs=labels[:, 5])
-    cos         = normalization(min_x=-1, max_x=1,          inputs=labels[:, 6])
-    detection   = normalization(min_x=-1, max_x=1,          inputs=labels[:, 7])
-
-    # new labels
-    x           = x.reshape((batch_size, 1))
-    y           = y.reshape((batch_size, 1))
-    yaw         = yaw.reshape((batch_size, 1))
-    width       = width.reshape((batch_size, 1))
-    height      = height.reshape((batch_size, 1))
-    sin         = sin.reshape((batch_size, 1))
-    cos         = cos.reshape((batch_size, 1))
-    detection   = detection.reshape((batch_size, 1))
-    all_vects   = [x, y, yaw, width, height, sin, cos, detection]
-    # fmt: on
-
-    # generate my labels
-    my_labels = []
-    for name, vector in zip(all_names, all_vects):
-        if name in variables:
-            my_labels.append(vector)
-
-    filter_labels = np.hstack(tuple(my_labels))
+    with stage(profiler, "make_data_batch", batch_size):
+        # This data generation process has been modified to work with spaceship or no spaceship
+        if curriculum is not None:
+            imgs, labels = curriculum.make_data_batch(
+                batch_size, has_spaceship=has_spaceship, rng=rng, dtype=np.float32
+            )
+        else:
+            imgs, labels = make_data_batch(
+                batch_size=batch_size,
+                has_spaceship=has_spaceship,
+                noise_level=noise_level,
+                rng=rng,
+                dtype=np.float32,
+            )
+
+    with stage(profiler, "make_batch_labels", batch_size):
+        # fmt: off
+        imgs        = 2 * imgs - 1       # normalize image
+        labels      = add_angle_labels(batch_size, labels)
+        labels      = add_detection_labels(batch_size, labels)
+        all_names   = ["x", "y", "yaw", "width", "height", "sin", "cos", "detection"]
+
+        # normalization of outputs
+        x           = normalization(min_x=10, max_x=190,        inputs=labels[:, 0])
+        y           = normalization(min_x=10, max_x=190,        inputs=labels[:, 1])
+        yaw         = normalization(min_x=0,  max_x=2*np.pi,    inputs=labels[:, 2])
+        width       = normalization(min_x=18, max_x=36,         inputs=labels[:, 3])
+        height      = normalization(min_x=18, max_x=75,         inputs=labels[:, 4])
+        sin         = normalization(min_x=-1, max_x=1,          inputs=labels[:, 5])
+        cos         = normalization(min_x=-1, max_x=1,          inputs=labels[:, 6])
+        detection   = normalization(min_x=-1, max_x=1,          inputs=labels[:, 7])
+
+        # new labels
+        x           = x.reshape((batch_size, 1))
+        y           = y.reshape((batch_size, 1))
+        yaw         = yaw.reshape((batch_size, 1))
+        width       = width.reshape((batch_size, 1))
+        height      = height.reshape((batch_size, 1))
+        sin         = sin.reshape((batch_size, 1))
+        cos         = cos.reshape((batch_size, 1))
+        detection   = detection.reshape((batch_size, 1))
+        all_vects   = [x, y, yaw, width, height, sin, cos, detection]
+        # fmt: on
+
+        # generate my labels
+        my_labels = []
+        for name, vector in zip(all_names, all_vects):
+            if name in variables:
+                my_labels.append(vector)
+
+        filter_labels = np.hstack(tuple(my_labels))
 
     # checks
     check0 = imgs.min() < -1.0
@@ -426,17 +449,170 @@ class CustomSaverPred(keras.callbacks.Callback):
         self.model.save("save/model{}.hd5".format(epoch))
 
 
+def record_sample_losses(model: Model, batch_size: int) -> tf.Variable:
+    """Overrides the train step of a compiled model so the loss of every sample in the last batch is kept.
+
+    Args:
+        model (Model): Compiled model.
+        batch_size (int): Batch shape.
+
+    Returns:
+        tf.Variable: Per-sample losses of the most recent training batch.
+    """
+    sample_losses = tf.Variable(tf.zeros(batch_size), trainable=False)
+
+    def train_step(self, data):
+        x, y = data
+        with tf.GradientTape() as tape:
+            y_pred = self(x, training=True)
+            loss = self.compiled_loss(y, y_pred, regularization_losses=self.losses)
+
+        gradients = tape.gradient(loss, self.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.trainable_variables))
+        self.compiled_metrics.update_state(y, y_pred)
+
+        # `Loss.call` returns the unreduced loss of every sample
+        sample_losses.assign(self.loss.call(tf.cast(y, y_pred.dtype), y_pred))
+
+        return {m.name: m.result() for m in self.metrics}
+
+    model.train_step = types.MethodType(train_step, model)
+
+    return sample_losses
+
+
+def accumulate_gradients(model: Model, steps: int) -> keras.callbacks.Callback:
+    """Overrides the train step of a compiled model so gradients are averaged over `steps` micro-batches
+    before the optimizer is applied, i.e. every Keras step is a micro-batch.
+
+    BatchNormalization normalizes with the statistics of every micro-batch, as ghost batch
+    normalization does, and its moving averages are updated once per micro-batch.  Their momentum
+    is raised to the power `1 / steps` while the train step is traced, so they decay at the same
+    rate per optimizer update as without accumulation.  The returned callback puts the original
+    momentum back at the end of every epoch, so saved checkpoints keep it; list it before any
+    checkpoint callback.  Gradients left over at the end of an epoch, when the steps per epoch are
+    not a multiple of `steps`, are dropped, so an update never mixes batches of two epochs.
+
+    Args:
+        model (Model): Compiled model.
+        steps (int): Micro-batches per optimizer update.
+
+    Returns:
+        keras.callbacks.Callback: Resets the accumulated gradients and swaps the BatchNormalization momentum in and out around every epoch.
+    """
+    accumulated = [
+        tf.Variable(tf.zeros_like(v), trainable=False) for v in model.trainable_variables
+    ]
+    micro_step = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+    # the optimizer slots are created up front, variables cannot be created inside `tf.cond`
+    if hasattr(model.optimizer, "build"):
+        model.optimizer.build(model.trainable_variables)
+    else:
+        model.optimizer._create_all_weights(model.trainable_variables)
+
+    # nested models, e.g. the stacked heads, have BatchNormalization layers of their own
+    momentum = {
+        layer: layer.momentum for layer in model.submodules if isinstance(layer, BatchNormalization)
+    }
+
+    def train_step(self, data):
+        x, y = data
+        with tf.GradientTape() as tape:
+            y_pred = self(x, training=True)
+            loss = self.compiled_loss(y, y_pred, regularization_losses=self.losses)
+
+        gradients = tape.gradient(loss, self.trainable_variables)
+        for total, gradient in zip(accumulated, gradients):
+            total.assign_add(gradient / steps)
+        micro_step.assign_add(1)
+
+        def apply():
+            self.optimizer.apply_gradients(zip(accumulated, self.trainable_variables))
+            for total in accumulated:
+                total.assign(tf.zeros_like(total))
+            return tf.constant(True)
+
+        tf.cond(micro_step % steps == 0, apply, lambda: tf.constant(False))
+        self.compiled_metrics.update_state(y, y_pred)
+
+        return {m.name: m.result() for m in self.metrics}
+
+    model.train_step = types.MethodType(train_step, model)
+
+    def scale(epoch, logs=None):
+        for total in accumulated:
+            total.assign(tf.zeros_like(total))
+        micro_step.assign(0)
+        for layer, value in momentum.items():
+            layer.momentum = value ** (1 / steps)
+
+    def restore(*args):
+        for layer, value in momentum.items():
+            layer.momentum = value
+
+    return keras.callbacks.LambdaCallback(
+        on_epoch_begin=scale, on_epoch_end=restore, on_train_end=restore
+    )
+
+
+def scale_learning_rate(learning_rate: float, factor: float, rule: str = "sqrt") -> float:
+    """Scales a learning rate tuned for one batch size to a batch `factor` times larger.
+
+    Args:
+        learning_rate (float): Learning rate of the recipe.
+        factor (float): Effective batch size over the batch size of the recipe.
+        rule (str, optional): "linear" (SGD) or "sqrt" (Adam), "none" keeps the learning rate. Defaults to "sqrt".
+
+    Returns:
+        float: Scaled learning rate.
+    """
+    if rule == "linear":
+        return learning_rate * factor
+    if rule == "sqrt":
+        return learning_rate * np.sqrt(factor)
+    if rule == "none":
+        return learning_rate
+    raise ValueError(f"Unknown learning rate scaling rule: {rule}")
+
+
+class ReplayPriorityUpdater(keras.callbacks.Callback):
+    """Custom Keras callback feeding per-sample losses back to a replay buffer."""
+
+    def __init__(self, replay: ReplayBuffer, sample_losses: tf.Variable):
+        super().__init__()
+        self.replay = replay
+        self.sample_losses = sample_losses
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.replay.update(self.sample_losses.numpy())
+
+    def on_train_end(self, logs=None):
+        # batches prefetched by Keras but never trained on
+        self.replay.clear_pending()
+
+
 def train_model(
     batch_size: int = 64,
     model_path: str = "save/",
     model_name: str = "saved_model.pb",
     steps_per_epoch: int = 250,
     epochs: int = 50,
-    loss: object = keras.losses.MeanSquaredError(),
-    optimizer: object = keras.optimizers.Adam(),
+    loss: Optional[object] = None,
+    optimizer: Optional[object] = None,
     variables: list = ["x", "y", "yaw", "width", "height", "sin", "cos", "detection"],
     has_spaceship: bool = True,
     base_model: Callable = gen_base_model,
+    seed: Optional[int] = None,
+    replay: Optional[ReplayBuffer] = None,
+    runtime: Optional[RuntimeConfig] = None,
+    callbacks: Optional[list] = None,
+    curriculum: Optional[NoiseCurriculum] = None,
+    accumulation_steps: int = 1,
+    lr_scaling: str = "sqrt",
+    ap_samples: int = 0,
+    patience: Optional[int] = None,
+    model: Optional[Model] = None,
 ):
     """Performing training on model.
 
@@ -446,155 +622,314 @@ def train_model(
         model_name (str, optional): Name of model. Defaults to "saved_model.pb".
         steps_per_epoch (int, optional): Number of training steps per epoch. Defaults to 250.
         epochs (int, optional): Number of epochs to train. Defaults to 50.
-        loss (object, optional): Loss function. Defaults to keras.losses.MeanSquaredError().
-        optimizer (object, optional): Optimizer to use. Defaults to keras.optimizers.Adam().
+        loss (object, optional): Loss function. Defaults to None (keras.losses.MeanSquaredError()).
+        optimizer (object, optional): Optimizer to use. Defaults to None (keras.optimizers.Adam()).
         variables (list, optional): Variables of interest. Defaults to ["x", "y", "yaw", "width", "height", "sin", "cos", "detection"].
         has_spaceship (bool, optional): Flag to indicate spaceship exists. Defaults to True.
         base_model (Callable, optional): The base model to use. Defaults to gen_base_model.
+        seed (int, optional): Root seed, batch k is drawn with `sample_rng(seed, 0, k)`, see `DataWorkers` for the streams of data workers. Defaults to None (unseeded).
+        replay (ReplayBuffer, optional): Mix fresh samples with hard replayed samples. Defaults to None (all fresh).
+        runtime (RuntimeConfig, optional): Threading, core pinning and data workers. Defaults to None (TensorFlow defaults).
+        callbacks (list, optional): Additional Keras callbacks. Defaults to None.
+        curriculum (NoiseCurriculum, optional): Train on banked ships with a noise schedule. Defaults to None (default noise).
+        accumulation_steps (int, optional): Micro-batches of `batch_size` per optimizer update, `steps_per_epoch` counts micro-batches. Defaults to 1.
+        lr_scaling (str, optional): Rule scaling the learning rate to the effective batch, see `scale_learning_rate`. Defaults to "sqrt".
+        ap_samples (int, optional): Validation samples of a `BackgroundAP` checkpoint that replaces the loss checkpoint, drawn with `sample_rng(seed, 1)`. Defaults to 0 (loss checkpoint).
+        patience (int, optional): Scored epochs without an AP improvement before training stops, requires `ap_samples`. Defaults to None (never stops).
+        model (Model, optional): Model to train in place, e.g. a pruned head to fine-tune. Defaults to None (loaded from `model_path`, or built with `base_model`).
     """
+    if runtime is not None:
+        configure(runtime)
+
+    if accumulation_steps > 1 and replay is not None:
+        raise ValueError("Gradient accumulation and replay both override the train step")
+    if patience is not None and ap_samples <= 0:
+        raise ValueError("Early stopping monitors the AP, pass ap_samples")
+    if curriculum is not None and runtime is not None and runtime.data_workers > 0:
+        raise ValueError(
+            "The curriculum schedule lives in the training process, use no data workers"
+        )
+
+    # built here, building Keras objects at import time would fix the TensorFlow thread pools
+    loss = loss or keras.losses.MeanSquaredError()
+    optimizer = optimizer or keras.optimizers.Adam()
+
     # define callbacks
     saver = CustomSaverPred()
-    checkpoint = tf.keras.callbacks.ModelCheckpoint(
-        filepath=model_path,
-        monitor="loss",
-        verbose=1,
-        save_best_only=True,
-        mode="min",
-    )
+    if ap_samples > 0:
+        # imported here, `src.online_eval` imports `src.main` which imports this module
+        from src.online_eval import BackgroundAP
+
+        imgs, labels = make_data_batch(
+            ap_samples,
+            has_spaceship=has_spaceship,
+            rng=sample_rng(0 if seed is None else seed, stream=1),
+            dtype=np.float32,
+        )
+        checkpoint = BackgroundAP(
+            imgs, labels, variables=variables, filepath=model_path, patience=patience
+        )
+    else:
+        checkpoint = tf.keras.callbacks.ModelCheckpoint(
+            filepath=model_path,
+            monitor="loss",
+            verbose=1,
+            save_best_only=True,
+            mode="min",
+        )
 
     # retrieve saved model
-    if exists(model_path + "/" + model_name):
+    if model is not None:
+        print("INFO: TRAINING THE GIVEN MODEL")
+    elif exists(model_path + "/" + model_name):
         print("INFO: LOADING AN EXISTING MODEL")
-        model = load_model(model_path)
+        model = load_cached_model(model_path, clone=True)
     else:
         print("INFO: GENERATING A NEW MODEL")
         model = base_model()
 
+    if accumulation_steps > 1:
+        optimizer.learning_rate = scale_learning_rate(
+            float(K.get_value(optimizer.learning_rate)), accumulation_steps, lr_scaling
+        )
+
     model.compile(loss=loss, optimizer=optimizer)
     model.summary()
     print(f"Learning Rate: {K.eval(model.optimizer.lr)}")
-    model.fit_generator(
-        iter(
-            lambda: make_batch(
-                batch_size=batch_size,
+
+    callbacks = [checkpoint, *(callbacks or [])]
+    if accumulation_steps > 1:
+        callbacks.insert(0, accumulate_gradients(model, accumulation_steps))
+    if curriculum is not None:
+        callbacks.append(curriculum)
+    if replay is not None:
+        sample_losses = record_sample_losses(model, batch_size)
+        callbacks.append(ReplayPriorityUpdater(replay, sample_losses))
+
+    batch_index = itertools.count()
+    workers = contextlib.nullcontext()
+    if runtime is not None and runtime.data_workers > 0:
+        workers = DataWorkers(
+            runtime, seed, has_spaceship=has_spaceship, noise_level=0.8, variables=variables
+        )
+
+    # the worker processes are terminated even when training fails or is interrupted
+    with workers as data_workers:
+
+        def fresh_batch(n: int) -> Tuple[np.ndarray, np.ndarray]:
+            if data_workers is not None:
+                return data_workers(n)
+            return make_batch(
+                batch_size=n,
                 has_spaceship=has_spaceship,
                 noise_level=0.8,
                 variables=variables,
-            ),
-            None,
-        ),
-        callbacks=[checkpoint],
-        steps_per_epoch=steps_per_epoch,
-        epochs=epochs,
-    )
-
-
-def train_detection_model():
-    """Train a detection model.  This model is only concerned with determining whether a spaceship exists in the noise."""
-    BATCH_SIZE = 128
-    MODEL_PATH = "save/best_model_detection"
+                rng=None if seed is None else sample_rng(seed, 0, next(batch_index)),
+                curriculum=curriculum,
+            )
+
+        def next_batch() -> Tuple[np.ndarray, np.ndarray]:
+            if replay is None:
+                return fresh_batch(batch_size)
+            return replay.make_batch(fresh_batch, batch_size)
+
+        model.fit_generator(
+            iter(next_batch, None),
+            callbacks=callbacks,
+            steps_per_epoch=steps_per_epoch,
+            epochs=epochs,
+        )
+
+
+def train_detection_model(
+    batch_size: int = 128,
+    learning_rate: float = 0.001,
+    steps_per_epoch: int = 100,
+    epochs: int = 50,
+    model_path: str = "save/best_model_detection",
+    **kwargs,
+):
+    """Train a detection model.  This model is only concerned with determining whether a spaceship exists in the noise.
 
+    Args:
+        batch_size (int, optional): Batch shape. Defaults to 128.
+        learning_rate (float, optional): Adam learning rate. Defaults to 0.001.
+        steps_per_epoch (int, optional): Number of training steps per epoch. Defaults to 100.
+        epochs (int, optional): Number of epochs to train. Defaults to 50.
+        model_path (str, optional): Path to model. Defaults to "save/best_model_detection".
+        **kwargs: Passed through to `train_model`.
+    """
     # optimizer settings
-    adam = keras.optimizers.Adam(learning_rate=0.001, beta_1=0.9, beta_2=0.999)
+    adam = keras.optimizers.Adam(learning_rate=learning_rate, beta_1=0.9, beta_2=0.999)
     loss = keras.losses.MeanSquaredError()
 
     train_model(
-        batch_size=BATCH_SIZE,
-        model_path=MODEL_PATH,
-        steps_per_epoch=100,
-        epochs=50,
+        batch_size=batch_size,
+        model_path=model_path,
+        steps_per_epoch=steps_per_epoch,
+        epochs=epochs,
         loss=loss,
         optimizer=adam,
         variables=["detection"],
         has_spaceship=None,
         base_model=gen_detect,
+        **kwargs,
     )
 
 
-def train_area_model():
-    """Train an area model.  This model is only concerned with predicting the $width$ and $height$ of the spaceship."""
-    BATCH_SIZE = 64
-    MODEL_PATH = "save/best_model_area"
+def train_area_model(
+    batch_size: int = 64,
+    learning_rate: float = 0.001,
+    steps_per_epoch: int = 100,
+    epochs: int = 50,
+    model_path: str = "save/best_model_area",
+    **kwargs,
+):
+    """Train an area model.  This model is only concerned with predicting the $width$ and $height$ of the spaceship.
 
+    Args:
+        batch_size (int, optional): Batch shape. Defaults to 64.
+        learning_rate (float, optional): Adam learning rate. Defaults to 0.001.
+        steps_per_epoch (int, optional): Number of training steps per epoch. Defaults to 100.
+        epochs (int, optional): Number of epochs to train. Defaults to 50.
+        model_path (str, optional): Path to model. Defaults to "save/best_model_area".
+        **kwargs: Passed through to `train_model`.
+    """
     # optimizer settings
-    adam = keras.optimizers.Adam(learning_rate=0.001, beta_1=0.9, beta_2=0.999)
+    adam = keras.optimizers.Adam(learning_rate=learning_rate, beta_1=0.9, beta_2=0.999)
     loss = keras.losses.MeanSquaredError()
 
     train_model(
-        batch_size=BATCH_SIZE,
-        model_path=MODEL_PATH,
-        steps_per_epoch=100,
-        epochs=50,
+        batch_size=batch_size,
+        model_path=model_path,
+        steps_per_epoch=steps_per_epoch,
+        epochs=epochs,
         loss=loss,
         optimizer=adam,
         variables=["width", "height"],
         base_model=gen_area,
+        **kwargs,
     )
 
 
-def train_position_model():
-    """Train a position model.  This model is only concerned with predicting the $x$ and $y$ position of the spaceship."""
-    BATCH_SIZE = 128
-    MODEL_PATH = "save/best_model_position"
+def train_position_model(
+    batch_size: int = 128,
+    learning_rate: float = 0.00001,
+    steps_per_epoch: int = 100,
+    epochs: int = 100,
+    model_path: str = "save/best_model_position",
+    **kwargs,
+):
+    """Train a position model.  This model is only concerned with predicting the $x$ and $y$ position of the spaceship.
 
+    Args:
+        batch_size (int, optional): Batch shape. Defaults to 128.
+        learning_rate (float, optional): Adam learning rate. Defaults to 0.00001.
+        steps_per_epoch (int, optional): Number of training steps per epoch. Defaults to 100.
+        epochs (int, optional): Number of epochs to train. Defaults to 100.
+        model_path (str, optional): Path to model. Defaults to "save/best_model_position".
+        **kwargs: Passed through to `train_model`.
+    """
     # optimizer settings
-    adam = keras.optimizers.Adam(learning_rate=0.00001, beta_1=0.9, beta_2=0.999)
+    adam = keras.optimizers.Adam(learning_rate=learning_rate, beta_1=0.9, beta_2=0.999)
     loss = keras.losses.MeanSquaredError()
 
     train_model(
-        batch_size=BATCH_SIZE,
-        model_path=MODEL_PATH,
-        steps_per_epoch=100,
-        epochs=100,
+        batch_size=batch_size,
+        model_path=model_path,
+        steps_per_epoch=steps_per_epoch,
+        epochs=epochs,
         loss=loss,
         optimizer=adam,
         variables=["x", "y"],
         base_model=gen_position,
+        **kwargs,
     )
 
 
-def train_angle_model():
-    """Train an angle model.  This model is only concerned with predicting the angle of the spaceship."""
-    BATCH_SIZE = 128
-    MODEL_PATH = "save/best_model_angle"
+def train_angle_model(
+    batch_size: int = 128,
+    learning_rate: float = 0.001,
+    steps_per_epoch: int = 100,
+    epochs: int = 50,
+    model_path: str = "save/best_model_angle",
+    **kwargs,
+):
+    """Train an angle model.  This model is only concerned with predicting the angle of the spaceship.
 
+    Args:
+        batch_size (int, optional): Batch shape. Defaults to 128.
+        learning_rate (float, optional): Adam learning rate. Defaults to 0.001.
+        steps_per_epoch (int, optional): Number of training steps per epoch. Defaults to 100.
+        epochs (int, optional): Number of epochs to train. Defaults to 50.
+        model_path (str, optional): Path to model. Defaults to "save/best_model_angle".
+        **kwargs: Passed through to `train_model`.
+    """
     # optimizer settings
-    adam = keras.optimizers.Adam(learning_rate=0.001, beta_1=0.9, beta_2=0.999)
+    adam = keras.optimizers.Adam(learning_rate=learning_rate, beta_1=0.9, beta_2=0.999)
     loss = keras.losses.MeanSquaredError()
 
     train_model(
-        batch_size=BATCH_SIZE,
-        model_path=MODEL_PATH,
-        steps_per_epoch=100,
-        epochs=50,
+        batch_size=batch_size,
+        model_path=model_path,
+        steps_per_epoch=steps_per_epoch,
+        epochs=epochs,
         loss=loss,
         optimizer=adam,
         variables=["sin", "cos"],
         base_model=gen_angle,
+        **kwargs,
     )
 
 
-def train_base_model():
-    """Train a base model.  This model is the foundation model which the other models will use for fine-turning their predictions.  The base model is trained with more variables than the other derived models because it should be useful for all of the variables of interest."""
-    BATCH_SIZE = 64
-    MODEL_PATH = "save/base_model"
+def train_base_model(
+    batch_size: int = 64,
+    learning_rate: float = 0.001,
+    steps_per_epoch: int = 100,
+    epochs: int = 50,
+    model_path: str = "save/base_model",
+    **kwargs,
+):
+    """Train a base model.  This model is the foundation model which the other models will use for fine-turning their predictions.  The base model is trained with more variables than the other derived models because it should be useful for all of the variables of interest.
 
+    Args:
+        batch_size (int, optional): Batch shape. Defaults to 64.
+        learning_rate (float, optional): Adam learning rate. Defaults to 0.001.
+        steps_per_epoch (int, optional): Number of training steps per epoch. Defaults to 100.
+        epochs (int, optional): Number of epochs to train. Defaults to 50.
+        model_path (str, optional): Path to model. Defaults to "save/base_model".
+        **kwargs: Passed through to `train_model`.
+    """
     # optimizer settings
-    adam = keras.optimizers.Adam(learning_rate=0.001, beta_1=0.9, beta_2=0.999)
+    adam = keras.optimizers.Adam(learning_rate=learning_rate, beta_1=0.9, beta_2=0.999)
     loss = keras.losses.MeanSquaredError()
 
     train_model(
-        batch_size=BATCH_SIZE,
-        model_path=MODEL_PATH,
-        steps_per_epoch=100,
-        epochs=50,
+        batch_size=batch_size,
+        model_path=model_path,
+        steps_per_epoch=steps_per_epoch,
+        epochs=epochs,
         loss=loss,
         optimizer=adam,
         variables=["x", "y", "height", "width"],
         base_model=gen_base_model,
+        **kwargs,
     )
 
 
+# training recipes: function, saved model, predicted variables and whether images contain a spaceship
+RECIPES = {
+    "base": (train_base_model, "save/base_model", ["x", "y", "height", "width"], True),
+    "detection": (train_detection_model, "save/best_model_detection", ["detection"], None),
+    "position": (train_position_model, "save/best_model_position", ["x", "y"], True),
+    "angle": (train_angle_model, "save/best_model_angle", ["sin", "cos"], True),
+    "area": (train_area_model, "save/best_model_area", ["width", "height"], True),
+}
+
+# heads of the combined model, in output order
+HEADS = ["detection", "position", "angle", "area"]
+
+
 def main():
     """Main function for training all models."""
     # train base model